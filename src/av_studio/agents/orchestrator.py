@@ -3,15 +3,55 @@ Agent orchestrator coordinating multiple specialized agents.
 """
 
 import asyncio
+import hashlib
 import json
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 from enum import StrEnum
+from pathlib import Path
 from typing import Any
 
+import ahocorasick
+
 # from av_studio.llm.ollama_client import OllamaClient  # TODO: Create ollama_client module
+from av_studio.config.settings import settings
 from av_studio.gateway.router import TaskType
 from av_studio.llm.mlx_client import MLXClient, mlx_client
+from av_studio.processing.audio.pipeline import StemSeparationResult
+
+# Keyword groups for _infer_task_type, in priority order: when a request
+# matches several groups the earliest one wins
+TASK_TYPE_KEYWORDS: tuple[tuple[TaskType, tuple[str, ...]], ...] = (
+    (TaskType.AUDIO_TRANSCRIPTION, ("transcribe", "speech", "whisper")),
+    (TaskType.AUDIO_GENERATION, ("separate", "stems", "vocals", "drums")),
+    (TaskType.VIDEO_ANALYSIS, ("video", "frame", "scene")),
+    (TaskType.CREATIVE_WRITING, ("write", "create", "compose")),
+)
+
+
+def _build_keyword_automaton() -> ahocorasick.Automaton:
+    """Compile every task keyword into one automaton mapping to (priority, task type)."""
+    automaton = ahocorasick.Automaton()
+    for priority, (task_type, keywords) in enumerate(TASK_TYPE_KEYWORDS):
+        for keyword in keywords:
+            automaton.add_word(keyword, (priority, task_type))
+    automaton.make_automaton()
+    return automaton
+
+
+_KEYWORD_AUTOMATON = _build_keyword_automaton()
+
+# Longest excerpt of free text (transcripts, LLM replies) quoted back to the LLM
+SUMMARY_TEXT_CHARS = 200
+
+# Routing plans kept by CoordinatorAgent before the oldest is evicted
+PLAN_CACHE_SIZE = 256
+
+# Task types whose routing needs no LLM when the caller supplies the file
+LOCAL_AUDIO_ACTIONS: dict[TaskType, str] = {
+    TaskType.AUDIO_TRANSCRIPTION: "transcribe",
+    TaskType.AUDIO_GENERATION: "separate_stems",
+}
 
 
 class AgentRole(StrEnum):
@@ -66,8 +106,12 @@ class BaseAgent(ABC):
         pass
 
     async def think(self, prompt: str) -> str:
-        """Use LLM to reason about a problem."""
-        return self.llm.generate(prompt, system_prompt=self.system_prompt)
+        """
+        Use LLM to reason about a problem.
+        Goes through the shared client's batcher, so concurrent agents decode
+        together instead of queueing on the model one by one.
+        """
+        return await self.llm.submit(prompt, system_prompt=self.system_prompt)
 
 
 class CoordinatorAgent(BaseAgent):
@@ -79,6 +123,7 @@ class CoordinatorAgent(BaseAgent):
         super().__init__(AgentRole.COORDINATOR, llm_client)
         self.agents: dict[AgentRole, BaseAgent] = {}
         self.task_queue: asyncio.Queue[Task] = asyncio.Queue()
+        self._plan_cache: dict[tuple[str, ...], dict[str, Any]] = {}
 
     def _get_system_prompt(self) -> str:
         return """You are the coordinator agent for an A/V production studio.
@@ -109,8 +154,17 @@ When you receive a request, analyze it and output a JSON plan like:
 
     async def process(self, task: Task) -> Any:
         """Process a task by routing to appropriate agent."""
-        # Use LLM to understand and route the task
-        routing_prompt = f"""
+        cache_key = (
+            task.task_type,
+            task.description.strip().lower()[:512],
+            json.dumps(task.parameters, sort_keys=True, default=str),
+            *sorted(self.agents),
+        )
+        plan = self._plan_cache.get(cache_key) or self._local_plan(task)
+
+        if plan is None:
+            # Use LLM to understand and route the task
+            routing_prompt = f"""
 Analyze this task and determine which agent(s) should handle it:
 
 Task: {task.description}
@@ -120,34 +174,58 @@ Available agents: {list(self.agents.keys())}
 
 Respond with a JSON routing plan.
 """
-        plan_response = await self.think(routing_prompt)
-
-        try:
-            plan = json.loads(plan_response)
-            results: list[Any] = []
-
-            for subtask in plan.get("tasks", []):
-                agent_role = AgentRole(subtask["agent"].lower())
-                if agent_role in self.agents:
-                    agent = self.agents[agent_role]
-                    sub_task = Task(
-                        id=f"{task.id}_{len(results)}",
-                        description=subtask.get("action", ""),
-                        task_type=task.task_type,
-                        parameters=subtask.get("params", {}),
-                    )
-                    result = await agent.process(sub_task)
-                    results.append(result)
-
-            return {"plan": plan, "results": results}
-        except json.JSONDecodeError:
-            return {"error": "Failed to parse routing plan", "raw": plan_response}
+            plan_response = await self.think(routing_prompt)
+
+            try:
+                plan = json.loads(plan_response)
+            except json.JSONDecodeError:
+                return {"error": "Failed to parse routing plan", "raw": plan_response}
+
+            if len(self._plan_cache) >= PLAN_CACHE_SIZE:
+                self._plan_cache.pop(next(iter(self._plan_cache)))
+            self._plan_cache[cache_key] = plan
+
+        results: list[Any] = []
+
+        for subtask in plan.get("tasks", []):
+            agent_role = AgentRole(subtask["agent"].lower())
+            if agent_role in self.agents:
+                agent = self.agents[agent_role]
+                sub_task = Task(
+                    id=f"{task.id}_{len(results)}",
+                    description=subtask.get("action", ""),
+                    task_type=task.task_type,
+                    parameters=subtask.get("params", {}),
+                )
+                result = await agent.process(sub_task)
+                results.append(result)
+
+        return {"plan": plan, "results": results}
+
+    def _local_plan(self, task: Task) -> dict[str, Any] | None:
+        """
+        Build the routing plan without the LLM for single-step audio tasks.
+        Only used when the caller already supplied the audio file; otherwise the
+        LLM is still needed to pull parameters out of the description.
+        """
+        action = LOCAL_AUDIO_ACTIONS.get(task.task_type)
+        if action is None or AgentRole.AUDIO not in self.agents:
+            return None
+        if "audio_path" not in task.parameters:
+            return None
+
+        return {
+            "tasks": [{"agent": "AUDIO", "action": action, "params": task.parameters}],
+            "reasoning": f"{task.task_type.value} is handled directly by the audio agent",
+        }
 
     async def handle_user_request(self, user_input: str) -> str:
         """Main entry point for user requests."""
-        # Analyze the request
+        # Analyze the request. The ID is a stable content hash (str hash() is
+        # salted per process and collides quickly when reduced mod 10k)
+        task_hash = hashlib.blake2b(user_input.encode("utf-8"), digest_size=8).hexdigest()
         task = Task(
-            id=f"user_{hash(user_input) % 10000}",
+            id=f"user_{task_hash}",
             description=user_input,
             task_type=self._infer_task_type(user_input),
         )
@@ -159,26 +237,52 @@ Respond with a JSON routing plan.
 Based on these results, provide a helpful response to the user:
 
 Original request: {user_input}
-Results: {json.dumps(result, default=str)}
+Results: {self._summarize_result(result)}
 
 Provide a clear, concise summary of what was accomplished.
 """
         return await self.think(synthesis_prompt)
 
+    def _summarize_result(self, result: Any) -> str:
+        """
+        Render a task result as a compact line for the synthesis prompt.
+        Avoids dumping whole result objects (paths, transcript segments) as JSON,
+        which costs tokens and can overflow the context.
+        """
+        if isinstance(result, StemSeparationResult):
+            stems = ", ".join(
+                f"{name}={path}"
+                for name in ("vocals", "drums", "bass", "other")
+                if (path := getattr(result, name)) is not None
+            )
+            return f"stems written ({result.model_used}): {stems}"
+
+        if isinstance(result, dict):
+            if "error" in result:
+                return f"error: {result['error']}"
+            if "segments" in result and "text" in result:
+                return (
+                    f"transcript[{result.get('language')}] {len(result['segments'])} segments, "
+                    f"{result.get('duration') or 0.0:.1f}s: "
+                    f"{result['text'][:SUMMARY_TEXT_CHARS]!r}"
+                )
+            if "results" in result:
+                summaries = [self._summarize_result(r) for r in result["results"]]
+                return "; ".join(summaries) or "no subtasks were run"
+
+        return str(result)[:SUMMARY_TEXT_CHARS]
+
     def _infer_task_type(self, text: str) -> TaskType:
-        """Infer the task type from user input."""
-        text_lower = text.lower()
+        """Infer the task type from user input in a single pass over the text."""
+        best: tuple[int, TaskType] | None = None
 
-        if any(word in text_lower for word in ["transcribe", "speech", "whisper"]):
-            return TaskType.AUDIO_TRANSCRIPTION
-        if any(word in text_lower for word in ["separate", "stems", "vocals", "drums"]):
-            return TaskType.AUDIO_GENERATION
-        if any(word in text_lower for word in ["video", "frame", "scene"]):
-            return TaskType.VIDEO_ANALYSIS
-        if any(word in text_lower for word in ["write", "create", "compose"]):
-            return TaskType.CREATIVE_WRITING
+        for _, match in _KEYWORD_AUTOMATON.iter(text.lower()):
+            if best is None or match[0] < best[0]:
+                best = match
+                if best[0] == 0:
+                    break
 
-        return TaskType.CHAT
+        return best[1] if best is not None else TaskType.CHAT
 
 
 class AudioAgent(BaseAgent):
@@ -189,6 +293,9 @@ class AudioAgent(BaseAgent):
         from av_studio.processing.audio.pipeline import audio_processor
 
         self.processor = audio_processor
+        # Bounds concurrent audio jobs; each runs in a worker thread so the
+        # event loop stays free while Demucs/Whisper are busy
+        self._sem = asyncio.Semaphore(settings.max_concurrent_jobs)
 
     def _get_system_prompt(self) -> str:
         return """You are an audio processing expert agent.
@@ -209,19 +316,17 @@ Always explain what you're doing and why.
         params = task.parameters
 
         if "separate" in action or "stems" in action:
-            from pathlib import Path
-
             audio_path = Path(params.get("audio_path", ""))
             if audio_path.exists():
-                return self.processor.separate_stems(audio_path)
+                async with self._sem:
+                    return await asyncio.to_thread(self.processor.separate_stems, audio_path)
             return {"error": f"Audio file not found: {audio_path}"}
 
         if "transcribe" in action:
-            from pathlib import Path
-
             audio_path = Path(params.get("audio_path", ""))
             if audio_path.exists():
-                return self.processor.transcribe(audio_path)
+                async with self._sem:
+                    return await asyncio.to_thread(self.processor.transcribe, audio_path)
             return {"error": f"Audio file not found: {audio_path}"}
 
         # Use LLM to handle other requests
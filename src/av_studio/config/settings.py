@@ -2,7 +2,9 @@
 Central configuration using Pydantic Settings for type safety and validation.
 """
 
+import os
 from enum import StrEnum
+from functools import lru_cache
 from pathlib import Path
 
 from pydantic import Field  # type: ignore[import-not-found,unused-ignore]
@@ -39,6 +41,9 @@ class Settings(BaseSettings):  # type: ignore[misc]
     # Local LLM - MLX (recommended for M4 Max)
     mlx_default_model: str = "mlx-community/Llama-3.2-8B-Instruct-4bit"
     mlx_max_tokens: int = 4096
+    # Unix socket of a resident MLX worker (python -m av_studio.llm.mlx_worker);
+    # when set, processes share its loaded model instead of loading their own
+    mlx_worker_socket: Path | None = None
 
     # External APIs
     openai_api_key: str | None = None
@@ -65,10 +70,30 @@ class Settings(BaseSettings):  # type: ignore[misc]
     class Config:
         env_file = ".env"
         env_prefix = "AV_"
+        frozen = True
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Return the process-wide settings, validated and .env-parsed once.
 
-# Ensure directories exist
-for dir_path in [settings.base_dir, settings.media_dir, settings.models_dir, settings.cache_dir]:
-    dir_path.mkdir(parents=True, exist_ok=True)
+    Also creates the data directories on first call; set AV_SKIP_DIR_INIT=1 in
+    worker processes that can rely on the parent having done so.
+    """
+    settings = Settings()
+
+    if os.environ.get("AV_SKIP_DIR_INIT") != "1":
+        for dir_path in [
+            settings.base_dir,
+            settings.media_dir,
+            settings.models_dir,
+            settings.cache_dir,
+        ]:
+            if not dir_path.exists():
+                dir_path.mkdir(parents=True, exist_ok=True)
+
+    return settings
+
+
+settings = get_settings()
@@ -2,8 +2,13 @@
 Smart Router: Intelligent model selection based on task, cost, and performance.
 """
 
+from collections.abc import Sequence
 from dataclasses import dataclass
 from enum import StrEnum
+from functools import lru_cache
+
+import numpy as np
+from numba import njit  # type: ignore[import-untyped,unused-ignore]
 
 from av_studio.config.settings import ModelProvider
 
@@ -20,13 +25,118 @@ class TaskType(StrEnum):
     CREATIVE_WRITING = "creative_writing"
 
 
-@dataclass
+# One bit per task type, used to pack ModelCapability.supports into an int
+TASK_BITS: dict[TaskType, int] = {task: 1 << i for i, task in enumerate(TaskType)}
+
+
+# Score = features @ SCORE_WEIGHTS, features being [quality, cost efficiency,
+# latency efficiency, local preference], each in 0-1
+SCORE_WEIGHTS = np.array([40.0, 30.0, 20.0, 10.0])
+# Cost (USD) and latency (ms) at which their efficiency feature reaches zero
+SCORE_COST_CEILING_USD = 0.30
+SCORE_LATENCY_CEILING_MS = 2000
+
+# route() caches its ranking per token bucket; a latency estimate moving by
+# more than ROUTE_LATENCY_SHIFT invalidates the cache
+ROUTE_CACHE_SIZE = 1024
+ROUTE_INPUT_BUCKET = 512
+ROUTE_OUTPUT_BUCKET = 256
+ROUTE_LATENCY_SHIFT = 0.10
+
+# Latency samples kept per model, and how many of the newest feed the estimate
+LATENCY_HISTORY_SIZE = 100
+LATENCY_WINDOW = 10
+
+
+@njit(cache=True)
+def _route_kernel(
+    candidates: np.ndarray,
+    supports: np.ndarray,
+    max_context: np.ndarray,
+    cost_in: np.ndarray,
+    cost_out: np.ndarray,
+    quality: np.ndarray,
+    latency: np.ndarray,
+    is_local: np.ndarray,
+    task_bit: int,
+    input_tokens: int,
+    output_tokens: int,
+    max_cost: float,
+    min_quality: float,
+    require_local: bool,
+    prefer_local: bool,
+) -> tuple[int, float, int]:
+    """
+    Filter, cost and score the candidate models in one compiled loop.
+
+    candidates holds ascending registry indices. Mirrors SmartRouter._score.
+    Returns (index, cost, latency) of the best model, or index -1 when
+    nothing passes the filters. Only a strictly higher score replaces the
+    current best, so ties keep registry order.
+    """
+    best = -1
+    best_score = -np.inf
+    best_cost = 0.0
+
+    for i in candidates:
+        if (supports[i] & task_bit) == 0:
+            continue
+        if require_local and not is_local[i]:
+            continue
+        if input_tokens > max_context[i]:
+            continue
+
+        cost = (input_tokens / 1000) * cost_in[i] + (output_tokens / 1000) * cost_out[i]
+        if cost > max_cost:
+            continue
+        if quality[i] < min_quality:
+            continue
+
+        score = (
+            quality[i] * SCORE_WEIGHTS[0]
+            + max(0.0, 1 - cost / SCORE_COST_CEILING_USD) * SCORE_WEIGHTS[1]
+            + max(0.0, 1 - latency[i] / SCORE_LATENCY_CEILING_MS) * SCORE_WEIGHTS[2]
+            + (SCORE_WEIGHTS[3] if prefer_local and is_local[i] else 0.0)
+        )
+
+        if score > best_score:
+            best = i
+            best_score = score
+            best_cost = cost
+
+    if best < 0:
+        return -1, 0.0, 0
+    return best, best_cost, latency[best]
+
+
+# Compile (or load from the on-disk cache) at import rather than on the first request
+_route_kernel(
+    np.zeros(1, np.int64),
+    np.ones(1, np.int64),
+    np.ones(1, np.int64),
+    np.zeros(1, np.float64),
+    np.zeros(1, np.float64),
+    np.ones(1, np.float64),
+    np.zeros(1, np.int64),
+    np.ones(1, np.bool_),
+    1,
+    0,
+    0,
+    0.0,
+    0.0,
+    False,
+    True,
+)
+
+
+@dataclass(slots=True, frozen=True)
 class ModelCapability:
     """Defines what a model can do and its characteristics."""
 
+    key: str  # Registry key, "<provider>:<model>"
     provider: ModelProvider
     model_id: str
-    supports: list[TaskType]
+    supports: tuple[TaskType, ...]
     max_context: int
     cost_per_1k_input: float  # USD
     cost_per_1k_output: float  # USD
@@ -37,12 +147,13 @@ class ModelCapability:
 
 
 # Model registry - extend as needed
-MODEL_REGISTRY: dict[str, ModelCapability] = {
+MODEL_REGISTRY: tuple[ModelCapability, ...] = (
     # Local Models (FREE, low latency on M4 Max)
-    "ollama:llama3.2:8b": ModelCapability(
+    ModelCapability(
+        key="ollama:llama3.2:8b",
         provider=ModelProvider.OLLAMA,
         model_id="llama3.2:8b",
-        supports=[TaskType.CHAT, TaskType.CODE, TaskType.SUMMARIZATION],
+        supports=(TaskType.CHAT, TaskType.CODE, TaskType.SUMMARIZATION),
         max_context=128000,
         cost_per_1k_input=0.0,
         cost_per_1k_output=0.0,
@@ -51,10 +162,11 @@ MODEL_REGISTRY: dict[str, ModelCapability] = {
         is_local=True,
         requires_gpu=True,
     ),
-    "ollama:qwen2.5-coder:7b": ModelCapability(
+    ModelCapability(
+        key="ollama:qwen2.5-coder:7b",
         provider=ModelProvider.OLLAMA,
         model_id="qwen2.5-coder:7b",
-        supports=[TaskType.CODE, TaskType.CHAT],
+        supports=(TaskType.CODE, TaskType.CHAT),
         max_context=32000,
         cost_per_1k_input=0.0,
         cost_per_1k_output=0.0,
@@ -63,10 +175,11 @@ MODEL_REGISTRY: dict[str, ModelCapability] = {
         is_local=True,
         requires_gpu=True,
     ),
-    "mlx:llama-3.2-8b": ModelCapability(
+    ModelCapability(
+        key="mlx:llama-3.2-8b",
         provider=ModelProvider.MLX,
         model_id="mlx-community/Llama-3.2-8B-Instruct-4bit",
-        supports=[TaskType.CHAT, TaskType.CODE, TaskType.SUMMARIZATION, TaskType.CREATIVE_WRITING],
+        supports=(TaskType.CHAT, TaskType.CODE, TaskType.SUMMARIZATION, TaskType.CREATIVE_WRITING),
         max_context=128000,
         cost_per_1k_input=0.0,
         cost_per_1k_output=0.0,
@@ -76,40 +189,46 @@ MODEL_REGISTRY: dict[str, ModelCapability] = {
         requires_gpu=True,
     ),
     # External Models
-    "openai:gpt-4o": ModelCapability(
+    ModelCapability(
+        key="openai:gpt-4o",
         provider=ModelProvider.OPENAI,
         model_id="gpt-4o",
-        supports=[TaskType.CHAT, TaskType.CODE, TaskType.IMAGE_ANALYSIS, TaskType.CREATIVE_WRITING],
+        supports=(TaskType.CHAT, TaskType.CODE, TaskType.IMAGE_ANALYSIS, TaskType.CREATIVE_WRITING),
         max_context=128000,
         cost_per_1k_input=0.0025,
         cost_per_1k_output=0.01,
         avg_latency_ms=800,
         quality_score=0.95,
     ),
-    "anthropic:claude-3.5-sonnet": ModelCapability(
+    ModelCapability(
+        key="anthropic:claude-3.5-sonnet",
         provider=ModelProvider.ANTHROPIC,
         model_id="claude-3-5-sonnet-20241022",
-        supports=[TaskType.CHAT, TaskType.CODE, TaskType.CREATIVE_WRITING, TaskType.IMAGE_ANALYSIS],
+        supports=(TaskType.CHAT, TaskType.CODE, TaskType.CREATIVE_WRITING, TaskType.IMAGE_ANALYSIS),
         max_context=200000,
         cost_per_1k_input=0.003,
         cost_per_1k_output=0.015,
         avg_latency_ms=1000,
         quality_score=0.96,
     ),
-    "google:gemini-2.0-flash": ModelCapability(
+    ModelCapability(
+        key="google:gemini-2.0-flash",
         provider=ModelProvider.GOOGLE,
         model_id="gemini-2.0-flash",
-        supports=[TaskType.CHAT, TaskType.CODE, TaskType.IMAGE_ANALYSIS, TaskType.VIDEO_ANALYSIS],
+        supports=(TaskType.CHAT, TaskType.CODE, TaskType.IMAGE_ANALYSIS, TaskType.VIDEO_ANALYSIS),
         max_context=1000000,
         cost_per_1k_input=0.000075,
         cost_per_1k_output=0.0003,
         avg_latency_ms=400,
         quality_score=0.90,
     ),
-}
+)
+
+# Registry position of each model key
+MODEL_INDEX: dict[str, int] = {model.key: i for i, model in enumerate(MODEL_REGISTRY)}
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class RoutingDecision:
     """Result of the smart routing decision."""
 
@@ -120,7 +239,7 @@ class RoutingDecision:
     estimated_latency_ms: int
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class RouterConfig:
     """Configuration for the smart router."""
 
@@ -143,8 +262,38 @@ class SmartRouter:
 
     def __init__(self, config: RouterConfig | None = None):
         self.config = config or RouterConfig()
-        self.model_registry = MODEL_REGISTRY.copy()
-        self._latency_history: dict[str, list[float]] = {}
+        self.model_registry = MODEL_REGISTRY
+        # Registry as parallel columns so route() is a vectorized scan
+        models = self.model_registry
+        self._model_keys = [m.key for m in models]
+        self._model_index = MODEL_INDEX
+        self._supports = np.array(
+            [sum(TASK_BITS[task] for task in set(m.supports)) for m in models], dtype=np.int64
+        )
+        self._max_context = np.array([m.max_context for m in models], dtype=np.int64)
+        self._cost_in = np.array([m.cost_per_1k_input for m in models], dtype=np.float64)
+        self._cost_out = np.array([m.cost_per_1k_output for m in models], dtype=np.float64)
+        self._quality = np.array([m.quality_score for m in models], dtype=np.float64)
+        self._is_local = np.array([m.is_local for m in models], dtype=np.bool_)
+        # Current latency estimate per model, refreshed by record_latency()
+        self._latency = np.array([m.avg_latency_ms for m in models], dtype=np.int64)
+
+        # Per-model ring buffer of recorded latencies, plus a running sum of
+        # the newest LATENCY_WINDOW samples
+        self._latency_history = np.zeros((len(models), LATENCY_HISTORY_SIZE))
+        self._latency_pos = np.zeros(len(models), dtype=np.int64)
+        self._latency_count = np.zeros(len(models), dtype=np.int64)
+        self._latency_sum = np.zeros(len(models))
+
+        # Selections are cached per epoch; record_latency() starts a new one
+        self._routing_epoch = 0
+        self._epoch_latency = self._latency.copy()
+        self._select = lru_cache(maxsize=ROUTE_CACHE_SIZE)(self._select_uncached)
+        self._local_indices = np.flatnonzero(self._is_local)
+        self._frontier_by_task: dict[TaskType, np.ndarray] = {}
+        # Frontier restricted to local models, for require_local requests
+        self._local_frontier_by_task: dict[TaskType, np.ndarray] = {}
+        self._build_frontiers()
 
     def route(
         self,
@@ -169,70 +318,210 @@ class SmartRouter:
         Returns:
             RoutingDecision with the selected model and reasoning
         """
-        candidates = []
-
-        for key, model in self.model_registry.items():
-            # Filter by task support
-            if task not in model.supports:
-                continue
-
-            # Filter by local requirement
-            if require_local and not model.is_local:
-                continue
-
-            # Filter by context length
-            if input_tokens > model.max_context:
-                continue
-
-            # Calculate estimated cost
-            cost = self._calculate_cost(model, input_tokens, expected_output_tokens)
-
-            # Filter by cost - handle explicit zero max_cost
-            effective_max_cost = self.config.max_cost_usd if max_cost is None else max_cost
-            if cost > effective_max_cost:
-                continue
-
-            # Filter by quality
-            min_quality = require_quality or self.config.min_quality_score
-            if model.quality_score < min_quality:
-                continue
-
-            # Get dynamic latency estimate
-            latency = self._get_latency_estimate(key, model)
-
-            candidates.append((key, model, cost, latency))
-
-        if not candidates:
-            # Fallback to default
-            fallback = self.model_registry[self.config.fallback_model]
-            return RoutingDecision(
-                model_key=self.config.fallback_model,
-                model=fallback,
-                reason="No suitable model found, using fallback",
-                estimated_cost=0.0,
-                estimated_latency_ms=fallback.avg_latency_ms,
+        # Handle explicit zero max_cost
+        effective_max_cost = self.config.max_cost_usd if max_cost is None else max_cost
+        min_quality = require_quality or self.config.min_quality_score
+
+        # Rank at the bottom of the token buckets: any model that fits the
+        # request also fits there, so an empty result is final
+        best = self._select(
+            task,
+            input_tokens - input_tokens % ROUTE_INPUT_BUCKET,
+            expected_output_tokens - expected_output_tokens % ROUTE_OUTPUT_BUCKET,
+            require_local,
+            min_quality,
+            effective_max_cost,
+            self._routing_epoch,
+        )
+        if best < 0:
+            return self._fallback_decision()
+
+        model = self.model_registry[best]
+        cost = self._calculate_cost(model, input_tokens, expected_output_tokens)
+        if input_tokens > model.max_context or cost > effective_max_cost:
+            # The bucket's pick overflows this request; rank on the exact counts
+            best = self._select_uncached(
+                task,
+                input_tokens,
+                expected_output_tokens,
+                require_local,
+                min_quality,
+                effective_max_cost,
+                self._routing_epoch,
+            )
+            if best < 0:
+                return self._fallback_decision()
+            cost = self._calculate_cost(
+                self.model_registry[best], input_tokens, expected_output_tokens
             )
+        return self._decision(best, cost, task)
+
+    def get_model(self, model_key: str) -> ModelCapability:
+        """Look up a registry model by key."""
+        return self.model_registry[self._model_index[model_key]]
+
+    def _select_uncached(
+        self,
+        task: TaskType,
+        input_tokens: int,
+        output_tokens: int,
+        require_local: bool,
+        min_quality: float,
+        max_cost: float,
+        epoch: int,
+    ) -> int:
+        """
+        Pick the best model index for the given token counts, or -1 if none qualifies.
+
+        epoch only keys the cache; selections from an older epoch are never reused.
+        """
+        frontiers = self._local_frontier_by_task if require_local else self._frontier_by_task
+        best, _, _ = _route_kernel(
+            frontiers[task],
+            self._supports,
+            self._max_context,
+            self._cost_in,
+            self._cost_out,
+            self._quality,
+            self._latency,
+            self._is_local,
+            TASK_BITS[task],
+            input_tokens,
+            output_tokens,
+            max_cost,
+            min_quality,
+            require_local,
+            self.config.prefer_local,
+        )
+        return int(best)
+
+    def route_batch(
+        self,
+        tasks: Sequence[TaskType],
+        input_tokens: Sequence[int],
+        expected_output_tokens: Sequence[int] | int = 500,
+        require_local: bool = False,
+        require_quality: float | None = None,
+        max_cost: float | None = None,
+    ) -> list[RoutingDecision]:
+        """
+        Select the optimal model for many requests in one vectorized pass.
 
-        # Score and sort candidates
-        scored = []
-        for key, model, cost, latency in candidates:
-            score = self._score_model(model, cost, latency)
-            scored.append((score, key, model, cost, latency))
+        Like calling route() once per request, with the constraint arguments
+        shared by the whole batch, but ranking on exact token counts
+        rather than route()'s cached token buckets.
 
-        scored.sort(reverse=True, key=lambda x: x[0])
-        best_score, best_key, best_model, best_cost, best_latency = scored[0]
+        Args:
+            tasks: Task type of each request
+            input_tokens: Estimated input token count of each request
+            expected_output_tokens: Expected output tokens, per request or shared
+            require_local: Force local model selection
+            require_quality: Minimum quality score required
+            max_cost: Maximum cost allowed per request
 
-        # Generate reason
-        reason = self._generate_reason(best_model, best_cost, best_latency, task)
+        Returns:
+            One RoutingDecision per request, in input order
+        """
+        task_bits = np.array([TASK_BITS[task] for task in tasks], dtype=np.int64)
+        tokens_in = np.asarray(input_tokens, dtype=np.int64)
+        tokens_out = np.broadcast_to(np.asarray(expected_output_tokens), tokens_in.shape)
 
+        # [requests, models] cost matrix
+        cost = np.outer(tokens_in / 1000, self._cost_in) + np.outer(
+            tokens_out / 1000, self._cost_out
+        )
+        effective_max_cost = self.config.max_cost_usd if max_cost is None else max_cost
+        min_quality = require_quality or self.config.min_quality_score
+
+        mask = (
+            ((self._supports[None, :] & task_bits[:, None]) != 0)
+            & (self._max_context[None, :] >= tokens_in[:, None])
+            & (cost <= effective_max_cost)
+            & (self._quality >= min_quality)[None, :]
+        )
+        if require_local:
+            mask &= self._is_local[None, :]
+
+        # Restrict each request to its task's Pareto frontier
+        on_frontier = np.zeros(mask.shape, dtype=np.bool_)
+        for row, task in enumerate(tasks):
+            on_frontier[row, self._frontier_by_task[task]] = True
+        mask &= on_frontier
+
+        scores = np.where(mask, self._score(cost), -np.inf)
+        best = np.argmax(scores, axis=1)
+        found = mask.any(axis=1)
+
+        return [
+            self._decision(int(i), float(cost[row, i]), tasks[row])
+            if found[row]
+            else self._fallback_decision()
+            for row, i in enumerate(best)
+        ]
+
+    def _decision(self, index: int, cost: float, task: TaskType) -> RoutingDecision:
+        """Build the decision for the registry model at index."""
+        model = self.model_registry[index]
+        key = model.key
+        latency = int(self._latency[index])
+
+        return RoutingDecision(
+            model_key=key,
+            model=model,
+            reason=self._generate_reason(model, cost, latency, task),
+            estimated_cost=cost,
+            estimated_latency_ms=latency,
+        )
+
+    def _fallback_decision(self) -> RoutingDecision:
+        """Build the decision used when no model passes the filters."""
+        fallback = self.get_model(self.config.fallback_model)
         return RoutingDecision(
-            model_key=best_key,
-            model=best_model,
-            reason=reason,
-            estimated_cost=best_cost,
-            estimated_latency_ms=best_latency,
+            model_key=self.config.fallback_model,
+            model=fallback,
+            reason="No suitable model found, using fallback",
+            estimated_cost=0.0,
+            estimated_latency_ms=fallback.avg_latency_ms,
         )
 
+    def _build_frontiers(self) -> None:
+        """
+        Find, per task, the models not dominated by another supporting model.
+
+        Model A dominates B when A is at least as good on every axis routing
+        looks at (input and output price, quality, latency, context window and
+        locality) and strictly better on one. A then passes every filter B
+        passes and never scores lower, so B need not be scored. Of identical
+        models, the first in the registry is kept. Latency is the current
+        estimate the scoring uses, so the frontier is rebuilt whenever it moves.
+        """
+        # Every column oriented so that lower is better
+        axes = np.stack(
+            [
+                self._cost_in,
+                self._cost_out,
+                -self._quality,
+                self._latency,
+                -self._max_context,
+                ~self._is_local,
+            ],
+            axis=1,
+        )
+
+        for task, bit in TASK_BITS.items():
+            indices = np.flatnonzero(self._supports & bit)
+            values = axes[indices]
+            # [a, b]: model a is at least as good as model b on every axis
+            no_worse = (values[:, None, :] <= values[None, :, :]).all(axis=-1)
+            better = (values[:, None, :] < values[None, :, :]).any(axis=-1)
+            earlier = np.triu(np.ones((len(indices), len(indices)), dtype=np.bool_), k=1)
+            dominated = (no_worse & (better | (no_worse.T & earlier))).any(axis=0)
+            self._frontier_by_task[task] = indices[~dominated]
+            # Only local models can dominate a local one, so this is exact
+            self._local_frontier_by_task[task] = np.intersect1d(
+                indices[~dominated], self._local_indices
+            )
+
     def _calculate_cost(
         self, model: ModelCapability, input_tokens: int, output_tokens: int
     ) -> float:
@@ -243,38 +532,30 @@ class SmartRouter:
 
     def _get_latency_estimate(self, key: str, model: ModelCapability) -> int:
         """Get latency estimate, using historical data if available."""
-        if key in self._latency_history and self._latency_history[key]:
-            # Use moving average of last 10 requests
-            recent = self._latency_history[key][-10:]
-            return int(sum(recent) / len(recent))
+        index = self._model_index[key]
+        count = self._latency_count[index]
+        if count:
+            # Moving average of the last LATENCY_WINDOW requests
+            return int(self._latency_sum[index] / min(count, LATENCY_WINDOW))
         return model.avg_latency_ms
 
-    def _score_model(self, model: ModelCapability, cost: float, latency: int) -> float:
+    def _score(self, cost: np.ndarray) -> np.ndarray:
         """
-        Score a model based on multiple factors.
+        Score every registry model given its estimated cost.
+
+        cost is either one row of model costs or a [requests, models] matrix.
         Higher score = better choice.
         """
-        score = 0.0
-
-        # Quality contributes 40%
-        score += model.quality_score * 40
-
-        # Cost efficiency contributes 30% (lower cost = higher score)
-        if cost == 0:
-            score += 30  # Free is best
-        else:
-            cost_score = max(0, 30 - (cost * 100))  # Penalize high cost
-            score += cost_score
-
-        # Latency contributes 20% (lower latency = higher score)
-        latency_score = max(0, 20 - (latency / 100))
-        score += latency_score
-
-        # Local preference contributes 10%
-        if self.config.prefer_local and model.is_local:
-            score += 10
-
-        return score
+        features = np.stack(
+            np.broadcast_arrays(
+                self._quality,
+                np.maximum(0, 1 - cost / SCORE_COST_CEILING_USD),
+                np.maximum(0, 1 - self._latency / SCORE_LATENCY_CEILING_MS),
+                self._is_local & self.config.prefer_local,
+            ),
+            axis=-1,
+        )
+        return features @ SCORE_WEIGHTS
 
     def _generate_reason(
         self, model: ModelCapability, cost: float, latency: int, task: TaskType
@@ -294,12 +575,31 @@ class SmartRouter:
 
     def record_latency(self, model_key: str, latency_ms: float) -> None:
         """Record actual latency for future routing decisions."""
-        if model_key not in self._latency_history:
-            self._latency_history[model_key] = []
-        self._latency_history[model_key].append(latency_ms)
-        # Keep only last 100 measurements
-        if len(self._latency_history[model_key]) > 100:
-            self._latency_history[model_key] = self._latency_history[model_key][-100:]
+        if model_key not in self._model_index:
+            return
+
+        index = self._model_index[model_key]
+        history = self._latency_history[index]
+        pos = self._latency_pos[index]
+
+        # Drop the sample leaving the moving-average window
+        if self._latency_count[index] >= LATENCY_WINDOW:
+            self._latency_sum[index] -= history[(pos - LATENCY_WINDOW) % LATENCY_HISTORY_SIZE]
+        history[pos] = latency_ms
+        self._latency_sum[index] += latency_ms
+        self._latency_pos[index] = (pos + 1) % LATENCY_HISTORY_SIZE
+        self._latency_count[index] = min(self._latency_count[index] + 1, LATENCY_HISTORY_SIZE)
+
+        latency = self._get_latency_estimate(model_key, self.model_registry[index])
+        if latency == self._latency[index]:
+            return
+        self._latency[index] = latency
+        self._build_frontiers()
+
+        baseline = self._epoch_latency[index]
+        if abs(latency - baseline) > ROUTE_LATENCY_SHIFT * baseline:
+            self._epoch_latency[index] = latency
+            self._routing_epoch += 1
 
 
 # Global router instance
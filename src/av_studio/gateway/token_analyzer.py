@@ -2,14 +2,51 @@
 Token analysis and cost calculation for LLM requests.
 """
 
+import os
+from collections import deque
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Any
 
 import tiktoken
-from transformers import AutoTokenizer
 
+# Most recent cost estimates kept by CostCalculator.spending_history
+SPENDING_HISTORY_SIZE = 10_000
 
-@dataclass
+# OpenAI chat framing overhead: tokens per message, per "name" field, and the
+# assistant reply priming added once per conversation
+TIKTOKEN_TOKENS_PER_MESSAGE = 3
+TIKTOKEN_TOKENS_PER_NAME = 1
+TIKTOKEN_REPLY_PRIMING = 3
+# encode_ordinary_batch starts a thread pool per call (~100 us), so smaller
+# batches are encoded one text at a time
+TIKTOKEN_THREADED_BATCH_MIN = 64
+
+# OpenAI prompt caching: prompts of at least 1024 tokens are cached in
+# 128-token increments, and cached input tokens are billed at half price
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_INCREMENT = 128
+PROMPT_CACHE_DISCOUNT = 0.5
+
+
+@lru_cache(maxsize=32)
+def get_tokenizer(model: str) -> tiktoken.Encoding:
+    """
+    Return the tiktoken encoding for a model, shared for the process lifetime.
+    Unknown model names use cl100k_base.
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def clear_tokenizer_cache() -> None:
+    """Drop the shared encodings, e.g. after swapping tiktoken's cache directory in tests."""
+    get_tokenizer.cache_clear()
+
+
+@dataclass(slots=True, frozen=True)
 class TokenCount:
     """Token count breakdown."""
 
@@ -19,7 +56,7 @@ class TokenCount:
     method: str  # Which tokenizer was used
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class CostEstimate:
     """Cost estimate for a request."""
 
@@ -39,7 +76,16 @@ class TokenAnalyzer:
 
     def __init__(self) -> None:
         self._tokenizers: dict[str, Any] = {}
-        self._tiktoken_encodings: dict[str, tiktoken.Encoding] = {}
+        self._preload_tiktoken()
+
+    def _preload_tiktoken(self) -> None:
+        """Load the common encodings now rather than on the first request."""
+        for model in ("gpt-4", "gpt-4o"):
+            try:
+                get_tokenizer(model)
+            except Exception:
+                # Offline with no cached file; counting falls back lazily
+                pass
 
     def count_tokens(self, text: str | list[dict[str, str]], model: str = "gpt-4o") -> TokenCount:
         """
@@ -52,26 +98,51 @@ class TokenAnalyzer:
         Returns:
             TokenCount with detailed breakdown
         """
-        # Convert messages to string if needed
-        if isinstance(text, list):
-            text = self._messages_to_text(text)
+        return self.count_tokens_batch([text], model)[0]
+
+    def count_tokens_batch(
+        self, texts: list[str | list[dict[str, str]]], model: str = "gpt-4o"
+    ) -> list[TokenCount]:
+        """
+        Count tokens for many texts or message lists at once.
 
+        For tiktoken-based models, large batches are encoded in one call
+        that spreads the work across threads outside the GIL; small ones
+        skip the thread pool. Message lists are counted per message rather
+        than as one concatenated string.
+
+        Args:
+            texts: Strings and/or lists of chat messages
+            model: The model to count tokens for
+
+        Returns:
+            One TokenCount per input, in input order
+        """
         # Select appropriate tokenizer
         if "gpt" in model.lower() or "openai" in model.lower():
-            count = self._count_tiktoken(text, model)
+            counts = self._count_tiktoken_items(texts, model)
             method = "tiktoken"
         elif "llama" in model.lower():
-            count = self._count_llama(text)
+            counts = [
+                self._count_llama_messages(t) if isinstance(t, list) else self._count_llama(t)
+                for t in texts
+            ]
             method = "llama-tokenizer"
         elif "claude" in model.lower():
             # Claude uses similar tokenization to GPT-4
-            count = self._count_tiktoken(text, "gpt-4")
+            counts = self._count_tiktoken_items(texts, "gpt-4")
             method = "tiktoken-approximation"
         else:
             # Fallback: rough estimate (4 chars per token average)
-            count = len(text) // 4
+            counts = [
+                len(self._messages_to_text(t) if isinstance(t, list) else t) // 4 for t in texts
+            ]
             method = "character-estimate"
 
+        return [self._token_count(count, method) for count in counts]
+
+    def _token_count(self, count: int, method: str) -> TokenCount:
+        """Build a TokenCount, estimating output tokens from the input."""
         # Estimate output tokens (configurable ratio)
         estimated_output = min(count // 2, 2000)  # Reasonable default
 
@@ -91,31 +162,79 @@ class TokenAnalyzer:
             parts.append(f"{role}: {content}")
         return "\n".join(parts)
 
-    def _count_tiktoken(self, text: str, model: str) -> int:
-        """Count tokens using tiktoken (OpenAI's tokenizer)."""
-        try:
-            if model not in self._tiktoken_encodings:
-                try:
-                    self._tiktoken_encodings[model] = tiktoken.encoding_for_model(model)
-                except KeyError:
-                    self._tiktoken_encodings[model] = tiktoken.get_encoding("cl100k_base")
+    def _count_tiktoken_items(
+        self, items: list[str | list[dict[str, str]]], model: str
+    ) -> list[int]:
+        """
+        Count strings and message lists with a single tiktoken batch.
 
-            return len(self._tiktoken_encodings[model].encode(text))
+        Messages follow OpenAI's num_tokens_from_messages: every field value is
+        encoded on its own and the fixed per-message framing is added on top.
+        Missing (None) values count as empty; other non-str values, such as
+        content-part lists, are counted as their str() form.
+        """
+        pieces: list[str] = []
+        spans: list[tuple[int, int, int]] = []  # (first piece, end piece, overhead)
+        for item in items:
+            start = len(pieces)
+            overhead = 0
+            if isinstance(item, str):
+                pieces.append(item)
+            else:
+                overhead = TIKTOKEN_REPLY_PRIMING
+                for message in item:
+                    overhead += TIKTOKEN_TOKENS_PER_MESSAGE
+                    for key, value in message.items():
+                        if value is not None:
+                            pieces.append(value if isinstance(value, str) else str(value))
+                        if key == "name":
+                            overhead += TIKTOKEN_TOKENS_PER_NAME
+            spans.append((start, len(pieces), overhead))
+
+        counts = self._count_tiktoken_batch(pieces, model)
+        return [sum(counts[start:end]) + overhead for start, end, overhead in spans]
+
+    def _count_tiktoken_batch(self, texts: list[str], model: str) -> list[int]:
+        """Count tokens using tiktoken (OpenAI's tokenizer), threaded for large batches."""
+        try:
+            encoding = get_tokenizer(model)
+            if len(texts) < TIKTOKEN_THREADED_BATCH_MIN:
+                return [len(encoding.encode_ordinary(text)) for text in texts]
+            encoded = encoding.encode_ordinary_batch(texts, num_threads=os.cpu_count() or 1)
+            return [len(ids) for ids in encoded]
         except Exception:
-            return len(text) // 4
+            return [len(text) // 4 for text in texts]
 
     def _count_llama(self, text: str) -> int:
         """Count tokens using Llama tokenizer."""
         try:
-            if "llama" not in self._tokenizers:
-                self._tokenizers["llama"] = AutoTokenizer.from_pretrained(
-                    "meta-llama/Llama-3.2-8B", use_fast=True
-                )
-            return len(self._tokenizers["llama"].encode(text))
+            return len(self._llama_tokenizer().encode(text))
         except Exception:
             # Fallback if model not available
             return len(text) // 4
 
+    def _count_llama_messages(self, messages: list[dict[str, str]]) -> int:
+        """Count chat messages with the Llama tokenizer's own chat template."""
+        try:
+            tokens = self._llama_tokenizer().apply_chat_template(
+                messages, tokenize=True, return_dict=False
+            )
+            return len(tokens)
+        except Exception:
+            # No chat template (or no tokenizer): count the flattened text
+            return self._count_llama(self._messages_to_text(messages))
+
+    def _llama_tokenizer(self) -> Any:
+        """Load the Llama tokenizer on first use."""
+        if "llama" not in self._tokenizers:
+            # transformers is slow to import and only needed for Llama models
+            from transformers import AutoTokenizer
+
+            self._tokenizers["llama"] = AutoTokenizer.from_pretrained(
+                "meta-llama/Llama-3.2-8B", use_fast=True
+            )
+        return self._tokenizers["llama"]
+
 
 class CostCalculator:
     """
@@ -143,18 +262,37 @@ class CostCalculator:
         "elevenlabs": {"per_character": 0.00003},
     }
 
-    def __init__(self) -> None:
+    def __init__(self, history_size: int = SPENDING_HISTORY_SIZE) -> None:
         self.total_spent: float = 0.0
         self.budget_limit: float | None = None
-        self.spending_history: list[CostEstimate] = []
-
-    def estimate_cost(self, model: str, input_tokens: int, output_tokens: int) -> CostEstimate:
-        """Estimate the cost for a request before making it."""
+        self.spending_history: deque[CostEstimate] = deque(maxlen=history_size)
+        # Running totals, so get_summary() does not depend on the capped history
+        self._by_model: dict[str, float] = {}
+        self._request_count = 0
+        # Longest key first, so "gpt-4o-mini" matches before "gpt-4o"
+        self._pricing_items = tuple(sorted(self.PRICING.items(), key=lambda kv: -len(kv[0])))
+        self._resolve_pricing = lru_cache(maxsize=512)(self._resolve_pricing_uncached)
+
+    @staticmethod
+    def cacheable_prompt_tokens(input_tokens: int) -> int:
+        """Upper bound on the input tokens a repeated OpenAI prompt can hit in cache."""
+        if input_tokens < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        return input_tokens - input_tokens % PROMPT_CACHE_INCREMENT
+
+    def estimate_cost(
+        self, model: str, input_tokens: int, output_tokens: int, cached_input_tokens: int = 0
+    ) -> CostEstimate:
+        """
+        Estimate the cost for a request before making it.
+        cached_input_tokens of the input are billed at the prompt-cache discount.
+        """
         pricing = self._get_pricing(model)
 
         # Handle non-token pricing (e.g., per_character for elevenlabs)
         if "input" in pricing and "output" in pricing:
-            input_cost = (input_tokens / 1000) * pricing["input"]
+            billed_input = input_tokens - cached_input_tokens * PROMPT_CACHE_DISCOUNT
+            input_cost = (billed_input / 1000) * pricing["input"]
             output_cost = (output_tokens / 1000) * pricing["output"]
             total = input_cost + output_cost
 
@@ -165,6 +303,7 @@ class CostCalculator:
                 model=model,
                 breakdown={
                     "input_tokens": input_tokens,
+                    "cached_input_tokens": cached_input_tokens,
                     "output_tokens": output_tokens,
                     "input_rate": pricing["input"],
                     "output_rate": pricing["output"],
@@ -200,6 +339,8 @@ class CostCalculator:
         """Record an actual cost after a request completes."""
         self.total_spent += estimate.total_cost
         self.spending_history.append(estimate)
+        self._by_model[estimate.model] = self._by_model.get(estimate.model, 0) + estimate.total_cost
+        self._request_count += 1
 
     def check_budget(self, estimated_cost: float) -> tuple[bool, str]:
         """Check if a request would exceed the budget."""
@@ -218,25 +359,22 @@ class CostCalculator:
 
     def get_summary(self) -> dict[str, Any]:
         """Get a summary of spending."""
-        by_model: dict[str, float] = {}
-        for estimate in self.spending_history:
-            model = estimate.model
-            by_model[model] = by_model.get(model, 0) + estimate.total_cost
-
         return {
             "total_spent": self.total_spent,
             "budget_limit": self.budget_limit,
             "remaining": (self.budget_limit - self.total_spent) if self.budget_limit else None,
-            "by_model": by_model,
-            "request_count": len(self.spending_history),
+            "by_model": dict(self._by_model),
+            "request_count": self._request_count,
         }
 
     def _get_pricing(self, model: str) -> dict[str, float]:
         """Get pricing for a model, with fallback."""
         # Normalize model name
-        model_lower = model.lower()
+        return self._resolve_pricing(model.lower())
 
-        for key, pricing in self.PRICING.items():
+    def _resolve_pricing_uncached(self, model_lower: str) -> dict[str, float]:
+        """Find the most specific PRICING key contained in a model name."""
+        for key, pricing in self._pricing_items:
             if key in model_lower:
                 return pricing
 
@@ -4,15 +4,39 @@ This provides the fastest local inference on M4 Max.
 """
 
 import asyncio
-from collections.abc import AsyncGenerator
+import hashlib
+import json
+import socket
+import threading
+from collections.abc import AsyncGenerator, Iterator
+from contextlib import contextmanager
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Any
 
-import mlx.core as mx
-from mlx_lm import generate, load, stream_generate
+from av_studio.config.settings import settings
 
+# Generated tokens the repetition penalty looks back over, when it is enabled
+REPETITION_CONTEXT_SIZE = 64
 
-@dataclass
+# Where quantize_model() writes re-quantized models, one directory per source/settings
+QUANTIZED_MLX_DIR = settings.cache_dir / "mlx"
+
+# Full-precision sources that are only worth loading as a quantize_model() build
+QUANTIZE_BEFORE_LOAD = frozenset({"meta-llama/Llama-3.2-3B-Instruct"})
+
+# Llama 3 chat template pieces, joined around the system and user text
+LLAMA_SYSTEM_PRE = "<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n\n"
+LLAMA_SYSTEM_POST = "<|eot_id|>"
+LLAMA_USER_PRE = "<|start_header_id|>user<|end_header_id|>\n\n"
+LLAMA_USER_POST = "<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
+LLAMA_BOS = "<|begin_of_text|>"
+
+# Marks the end of a token stream handed from the decode thread to the event loop
+_STREAM_END = object()
+
+
+@dataclass(slots=True, frozen=True)
 class MLXConfig:
     """Configuration for MLX models."""
 
@@ -20,7 +44,16 @@ class MLXConfig:
     max_tokens: int = 4096
     temperature: float = 0.7
     top_p: float = 0.9
-    repetition_penalty: float = 1.1
+    repetition_penalty: float = 1.0  # 1.0 disables the per-token penalty pass
+    # load_model() prefers a quantize_model() output with these settings if one exists
+    quant_bits: int = 3
+    quant_group_size: int = 64
+    # Speculative decoding: the draft proposes tokens that the main model verifies
+    speculative: bool = True
+    draft_model_path: str = "mlx-community/Llama-3.2-3B-Instruct-4bit"
+    num_draft_tokens: int = 3
+    # Send requests to a resident worker process instead of loading the model here
+    worker_socket: str | None = None
 
 
 class MLXClient:
@@ -33,23 +66,67 @@ class MLXClient:
         self.config = config or MLXConfig()
         self._model = None
         self._tokenizer = None
+        self._draft_model = None
         self._loaded_model_path: str | None = None
+        self._batch_queue: list[tuple[str, str | None, asyncio.Future[str]]] = []
+        self._batch_task: asyncio.Task[None] | None = None
+        # KV cache of the last system-prompt prefix: (system prompt, cache, prefix tokens)
+        self._system_cache: tuple[str, list[Any], int] | None = None
+        # generate, generate_batch and streams run on different threads but
+        # share the model, draft and system cache, so they take turns
+        self._model_lock = threading.Lock()
 
     def load_model(self, model_path: str | None = None) -> None:
         """
         Load an MLX model into memory.
         Models are cached - only reloads if path changes.
+        MLX is imported on first use, so remote-only deployments never pay for it.
+        A local quantize_model() build of the path is used when present.
         """
+        if self.config.worker_socket:
+            return  # The worker process holds the model
+
         path = model_path or self.config.model_path
 
         if self._model is not None and self._loaded_model_path == path:
             return  # Already loaded
 
-        print(f"Loading MLX model: {path}")
-        self._model, self._tokenizer = load(path)
+        load_path = self._resolve_load_path(path)
+
+        import mlx.core as mx
+        from mlx_lm import load
+
+        print(f"Loading MLX model: {load_path}")
+        self._model, self._tokenizer = load(load_path)
         self._loaded_model_path = path
+        self._system_cache = None
+
+        self._draft_model = None
+        if self.config.speculative and self.config.draft_model_path != path:
+            try:
+                self._draft_model, _ = load(self.config.draft_model_path)
+            except Exception as exc:
+                # Fall back to plain decoding with the main model
+                print(f"Draft model unavailable, speculative decoding off: {exc}")
         print(f"Model loaded. Using GPU device: {mx.default_device()}")
 
+    def _resolve_load_path(self, path: str) -> str:
+        """
+        Return the quantize_model() build of path if it exists, else path itself.
+        Raises FileNotFoundError for QUANTIZE_BEFORE_LOAD sources without a build,
+        rather than silently loading their full-precision weights.
+        """
+        bits, group_size = self.config.quant_bits, self.config.quant_group_size
+        quantized = quantized_model_dir(path, bits, group_size)
+        if quantized.exists():
+            return str(quantized)
+        if path in QUANTIZE_BEFORE_LOAD:
+            raise FileNotFoundError(
+                f"No {bits}-bit build of {path}; run "
+                f"quantize_model({path!r}, q_bits={bits}, q_group_size={group_size}) first"
+            )
+        return path
+
     def generate(
         self,
         prompt: str,
@@ -60,23 +137,146 @@ class MLXClient:
         """
         Generate a complete response (non-streaming).
         """
-        self.load_model()
+        if self.config.worker_socket:
+            return str(
+                self._worker_call(
+                    {
+                        "op": "generate",
+                        "prompt": prompt,
+                        "max_tokens": max_tokens,
+                        "temperature": temperature,
+                        "system_prompt": system_prompt,
+                    }
+                )
+            )
 
-        # Format prompt with system message if provided
-        full_prompt = self._format_prompt(prompt, system_prompt)
+        from mlx_lm import generate
 
-        response = generate(
-            model=self._model,
-            tokenizer=self._tokenizer,
-            prompt=full_prompt,
-            max_tokens=max_tokens or self.config.max_tokens,
-            temp=temperature or self.config.temperature,
-            top_p=self.config.top_p,
-            repetition_penalty=self.config.repetition_penalty,
-        )
+        with self._model_lock:
+            self.load_model()
+
+            # Format prompt with system message if provided
+            with self._cached_prompt(prompt, system_prompt) as (full_prompt, cache_kwargs):
+                response = generate(
+                    model=self._model,
+                    tokenizer=self._tokenizer,
+                    prompt=full_prompt,
+                    max_tokens=max_tokens or self.config.max_tokens,
+                    **self._sampling_kwargs(temperature),
+                    **cache_kwargs,
+                    **self._draft_kwargs(),
+                )
 
         return str(response)
 
+    async def agenerate(
+        self,
+        prompt: str,
+        max_tokens: int | None = None,
+        temperature: float | None = None,
+        system_prompt: str | None = None,
+    ) -> str:
+        """
+        Generate a complete response on a worker thread.
+        The event loop keeps serving other coroutines during inference.
+        """
+        return await asyncio.to_thread(
+            self.generate, prompt, max_tokens, temperature, system_prompt
+        )
+
+    def generate_batch(
+        self,
+        prompts: list[str],
+        system_prompts: list[str | None],
+        max_tokens: int | None = None,
+    ) -> list[str]:
+        """
+        Generate responses for several prompts in one batched decode.
+        Prefill and each decode step run for the whole batch at once, with the
+        same sampler and repetition penalty as generate(). mlx_lm's batch
+        decoder has no speculative decoding, so the draft model is unused here.
+        """
+        if self.config.worker_socket:
+            return list(
+                self._worker_call(
+                    {
+                        "op": "generate_batch",
+                        "prompts": prompts,
+                        "system_prompts": system_prompts,
+                        "max_tokens": max_tokens,
+                    }
+                )
+            )
+
+        from mlx_lm import batch_generate
+
+        with self._model_lock:
+            self.load_model()
+
+            prompt_tokens = [
+                self._tokenizer.encode(
+                    self._format_prompt(prompt, system), add_special_tokens=False
+                )
+                for prompt, system in zip(prompts, system_prompts, strict=True)
+            ]
+            response = batch_generate(
+                self._model,
+                self._tokenizer,
+                prompt_tokens,
+                max_tokens=max_tokens or self.config.max_tokens,
+                **self._sampling_kwargs(None),
+            )
+        return [str(text) for text in response.texts]
+
+    async def submit(self, prompt: str, system_prompt: str | None = None) -> str:
+        """
+        Queue a prompt for the next decode and wait for its response.
+        Prompts queued together (in the same event-loop turn, or while the
+        previous decode runs) share one decode; identical (prompt, system
+        prompt) pairs are generated once.
+        """
+        future: asyncio.Future[str] = asyncio.get_running_loop().create_future()
+        self._batch_queue.append((prompt, system_prompt, future))
+        if self._batch_task is None or self._batch_task.done():
+            self._batch_task = asyncio.create_task(self._drain_batches())
+        return await future
+
+    async def _drain_batches(self) -> None:
+        """
+        Run queued prompts until the queue is empty.
+        A lone prompt goes through agenerate(), keeping the system-prompt KV
+        cache and speculative decoding; only real batches use generate_batch.
+        """
+        while self._batch_queue:
+            batch, self._batch_queue = self._batch_queue, []
+
+            waiters: dict[tuple[str, str | None], list[asyncio.Future[str]]] = {}
+            for prompt, system_prompt, future in batch:
+                waiters.setdefault((prompt, system_prompt), []).append(future)
+            requests = list(waiters)
+
+            try:
+                if len(requests) == 1:
+                    prompt, system_prompt = requests[0]
+                    texts = [await self.agenerate(prompt, system_prompt=system_prompt)]
+                else:
+                    texts = await asyncio.to_thread(
+                        self.generate_batch,
+                        [prompt for prompt, _ in requests],
+                        [system_prompt for _, system_prompt in requests],
+                    )
+            except Exception as exc:
+                for futures in waiters.values():
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(exc)
+                continue
+
+            for request, text in zip(requests, texts, strict=True):
+                for future in waiters[request]:
+                    if not future.done():
+                        future.set_result(text)
+
     async def stream_generate(
         self,
         prompt: str,
@@ -86,55 +286,259 @@ class MLXClient:
     ) -> AsyncGenerator[str, None]:
         """
         Stream tokens as they're generated.
-        This provides the best UX for longer responses.
+        This provides the best UX for longer responses. Yields the text of each
+        token, in-process and through the worker alike.
         """
-        self.load_model()
+        if self.config.worker_socket:
+            async for token in self._worker_stream(
+                {
+                    "op": "stream",
+                    "prompt": prompt,
+                    "max_tokens": max_tokens,
+                    "temperature": temperature,
+                    "system_prompt": system_prompt,
+                }
+            ):
+                yield token
+            return
 
-        full_prompt = self._format_prompt(prompt, system_prompt)
+        from mlx_lm import stream_generate
 
-        # MLX stream_generate is synchronous, so we wrap it
-        for token in stream_generate(
-            model=self._model,
-            tokenizer=self._tokenizer,
-            prompt=full_prompt,
-            max_tokens=max_tokens or self.config.max_tokens,
-            temp=temperature or self.config.temperature,
-        ):
-            yield token
-            await asyncio.sleep(0)  # Yield control to event loop
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[Any] = asyncio.Queue()
+        stop = threading.Event()
 
-    def _format_prompt(self, prompt: str, system_prompt: str | None = None) -> str:
-        """Format prompt for Llama-style chat models."""
-        if system_prompt:
-            return f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+        # MLX stream_generate is synchronous, so decode on a thread and hand
+        # tokens to the event loop as they arrive
+        def produce() -> None:
+            try:
+                with self._model_lock:
+                    self.load_model()
+                    with self._cached_prompt(prompt, system_prompt) as (
+                        full_prompt,
+                        cache_kwargs,
+                    ):
+                        for response in stream_generate(
+                            model=self._model,
+                            tokenizer=self._tokenizer,
+                            prompt=full_prompt,
+                            max_tokens=max_tokens or self.config.max_tokens,
+                            **self._sampling_kwargs(temperature),
+                            **cache_kwargs,
+                            **self._draft_kwargs(),
+                        ):
+                            if stop.is_set():
+                                break
+                            loop.call_soon_threadsafe(queue.put_nowait, response.text)
+            except Exception as exc:
+                loop.call_soon_threadsafe(queue.put_nowait, exc)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, _STREAM_END)
 
-{system_prompt}<|eot_id|><|start_header_id|>user<|end_header_id|>
+        threading.Thread(target=produce, name="mlx-stream", daemon=True).start()
 
-{prompt}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
+        try:
+            while (item := await queue.get()) is not _STREAM_END:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stop decoding if the consumer goes away early
+            stop.set()
 
-"""
-        return f"""<|begin_of_text|><|start_header_id|>user<|end_header_id|>
+    def _worker_call(self, request: dict[str, Any]) -> Any:
+        """Send one request to the resident worker and return its result."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(self.config.worker_socket))
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            with sock.makefile("rb") as replies:
+                reply = json.loads(replies.readline())
 
-{prompt}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
+        if "error" in reply:
+            raise RuntimeError(f"MLX worker failed: {reply['error']}")
+        return reply["result"]
 
-"""
+    async def _worker_stream(self, request: dict[str, Any]) -> AsyncGenerator[str, None]:
+        """Send a streaming request to the resident worker and yield its tokens."""
+        reader, writer = await asyncio.open_unix_connection(str(self.config.worker_socket))
+        try:
+            writer.write(json.dumps(request).encode() + b"\n")
+            await writer.drain()
+            while line := await reader.readline():
+                reply = json.loads(line)
+                if "error" in reply:
+                    raise RuntimeError(f"MLX worker failed: {reply['error']}")
+                if reply.get("done"):
+                    break
+                yield reply["token"]
+        finally:
+            writer.close()
+
+    def _sampling_kwargs(self, temperature: float | None) -> dict[str, Any]:
+        """
+        mlx_lm sampler and logits-processor kwargs for the configured settings.
+        The repetition penalty is only added when enabled, and then looks back
+        over a bounded REPETITION_CONTEXT_SIZE window.
+        """
+        from mlx_lm.sample_utils import make_logits_processors, make_sampler
+
+        kwargs: dict[str, Any] = {
+            "sampler": make_sampler(
+                temp=temperature or self.config.temperature, top_p=self.config.top_p
+            )
+        }
+        if self.config.repetition_penalty != 1.0:
+            kwargs["logits_processors"] = make_logits_processors(
+                repetition_penalty=self.config.repetition_penalty,
+                repetition_context_size=REPETITION_CONTEXT_SIZE,
+            )
+        return kwargs
+
+    def _draft_kwargs(self) -> dict[str, Any]:
+        """mlx_lm kwargs that turn on speculative decoding when a draft is loaded."""
+        if self._draft_model is None:
+            return {}
+        return {
+            "draft_model": self._draft_model,
+            "num_draft_tokens": self.config.num_draft_tokens,
+        }
+
+    @contextmanager
+    def _cached_prompt(
+        self, prompt: str, system_prompt: str | None
+    ) -> Iterator[tuple[str | list[int], dict[str, Any]]]:
+        """
+        Reuse the KV cache of the system-prompt prefix across calls.
+
+        Yields the prompt still to be prefilled and extra generate() kwargs.
+        With a system prompt those are the user-turn tokens and the prefix
+        cache, which is trimmed back to the prefix afterwards so the next call
+        with the same system prompt skips its prefill. Callers hold _model_lock,
+        so calls sharing the cache run one at a time.
+        """
+        if not system_prompt:
+            yield self._format_prompt(prompt), {}
+            return
+
+        from mlx_lm.models.cache import can_trim_prompt_cache
+
+        cache, prefix_tokens = self._get_system_cache(system_prompt)
+        user_tokens = self._tokenizer.encode(
+            self._format_user_turn(prompt), add_special_tokens=False
+        )
+        try:
+            yield user_tokens, {"prompt_cache": cache}
+        finally:
+            if can_trim_prompt_cache(cache):
+                # Main and draft caches can end at different offsets
+                for layer_cache in cache:
+                    layer_cache.trim(layer_cache.offset - prefix_tokens)
+            else:
+                self._system_cache = None
+
+    def _get_system_cache(self, system_prompt: str) -> tuple[list[Any], int]:
+        """Return the KV cache prefilled with the system prefix, building it on a miss."""
+        if self._system_cache is not None and self._system_cache[0] == system_prompt:
+            return self._system_cache[1], self._system_cache[2]
+
+        import mlx.core as mx
+        from mlx_lm.models.cache import make_prompt_cache
+
+        tokens = self._tokenizer.encode(
+            self._format_system_prefix(system_prompt), add_special_tokens=False
+        )
+        # Speculative decoding expects the main model's layers then the draft's
+        cache = make_prompt_cache(self._model)
+        self._model(mx.array(tokens)[None], cache=cache)
+        if self._draft_model is not None:
+            draft_cache = make_prompt_cache(self._draft_model)
+            self._draft_model(mx.array(tokens)[None], cache=draft_cache)
+            cache += draft_cache
+        mx.eval([c.state for c in cache])
+
+        self._system_cache = (system_prompt, cache, len(tokens))
+        return cache, len(tokens)
+
+    def _format_system_prefix(self, system_prompt: str) -> str:
+        """Format the system-message prefix shared by every turn."""
+        return "".join((LLAMA_SYSTEM_PRE, system_prompt, LLAMA_SYSTEM_POST))
+
+    def _format_user_turn(self, prompt: str) -> str:
+        """Format the user message and the assistant header that follows it."""
+        return "".join((LLAMA_USER_PRE, prompt, LLAMA_USER_POST))
+
+    def _format_prompt(self, prompt: str, system_prompt: str | None = None) -> str:
+        """Format prompt for Llama-style chat models."""
+        if system_prompt:
+            return "".join(
+                (
+                    LLAMA_SYSTEM_PRE,
+                    system_prompt,
+                    LLAMA_SYSTEM_POST,
+                    LLAMA_USER_PRE,
+                    prompt,
+                    LLAMA_USER_POST,
+                )
+            )
+        return "".join((LLAMA_BOS, LLAMA_USER_PRE, prompt, LLAMA_USER_POST))
 
     def get_model_info(self) -> dict[str, Any]:
         """Get information about the loaded model."""
+        if self.config.worker_socket:
+            return dict(self._worker_call({"op": "info"}))
+
         if self._model is None:
             return {"status": "not_loaded"}
 
+        import mlx.core as mx
+
         return {
             "status": "loaded",
             "model_path": self._loaded_model_path,
+            "draft_model_path": self.config.draft_model_path if self._draft_model else None,
             "device": str(mx.default_device()),
             "memory_info": "Unified memory (M4 Max)",
         }
 
 
+def quantized_model_dir(hf_path: str, q_bits: int = 3, q_group_size: int = 64) -> Path:
+    """Directory quantize_model() writes hf_path to for the given settings."""
+    digest = hashlib.blake2b(
+        f"{hf_path}:{q_bits}:{q_group_size}".encode(), digest_size=8
+    ).hexdigest()
+    return QUANTIZED_MLX_DIR / digest
+
+
+def quantize_model(hf_path: str, q_bits: int = 3, q_group_size: int = 64) -> Path:
+    """
+    Quantize a model with mlx_lm.convert once and return the output directory.
+
+    Decode on Apple Silicon is memory-bandwidth bound, so 3-bit weights decode
+    roughly a quarter faster than 4-bit ones. Start from full-precision weights,
+    not an already-quantized community repo, and check output quality on your
+    own prompts before making the result the default.
+    """
+    output_dir = quantized_model_dir(hf_path, q_bits, q_group_size)
+    if output_dir.exists():
+        return output_dir
+
+    from mlx_lm import convert
+
+    output_dir.parent.mkdir(parents=True, exist_ok=True)
+    convert(
+        hf_path,
+        mlx_path=str(output_dir),
+        quantize=True,
+        q_bits=q_bits,
+        q_group_size=q_group_size,
+    )
+    return output_dir
+
+
 # Recommended models for M4 Max (36GB unified memory)
 RECOMMENDED_MLX_MODELS = {
     "fast": "mlx-community/Llama-3.2-3B-Instruct-4bit",  # ~2GB, fastest
+    "fast-q3": "meta-llama/Llama-3.2-3B-Instruct",  # ~1.5GB, 3-bit; run quantize_model() first
     "balanced": "mlx-community/Llama-3.2-8B-Instruct-4bit",  # ~5GB, good balance
     "quality": "mlx-community/Llama-3.3-70B-Instruct-4bit",  # ~40GB, best quality (fits in 36GB with offload)
     "code": "mlx-community/Qwen2.5-Coder-7B-Instruct-4bit",  # ~4GB, optimized for code
@@ -143,4 +547,6 @@ RECOMMENDED_MLX_MODELS = {
 
 
 # Global client instance
-mlx_client = MLXClient()
+mlx_client = MLXClient(
+    MLXConfig(worker_socket=str(settings.mlx_worker_socket) if settings.mlx_worker_socket else None)
+)
@@ -0,0 +1,83 @@
+"""
+Resident MLX worker: loads the model once and serves it over a Unix socket.
+
+Run one per machine with `python -m av_studio.llm.mlx_worker` and point
+AV_MLX_WORKER_SOCKET at its socket, so every gateway and agent process shares
+a single copy of the weights in unified memory. Requests and replies are
+newline-delimited JSON.
+"""
+
+import asyncio
+import json
+from pathlib import Path
+from typing import Any
+
+from av_studio.config.settings import settings
+from av_studio.llm.mlx_client import MLXClient
+
+# Default socket path when AV_MLX_WORKER_SOCKET is not set
+DEFAULT_SOCKET = settings.cache_dir / "mlx-worker.sock"
+
+
+class MLXWorker:
+    """Serve one in-process MLXClient to clients of the resident worker."""
+
+    def __init__(self, client: MLXClient | None = None):
+        self.client = client or MLXClient()
+        # MLX runs one decode at a time; the client batches before sending
+        self._lock = asyncio.Lock()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer every request sent on one connection."""
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                op = request.pop("op")
+                try:
+                    async with self._lock:
+                        if op == "stream":
+                            async for token in self.client.stream_generate(**request):
+                                self._send(writer, {"token": token})
+                                await writer.drain()
+                            reply: dict[str, Any] = {"done": True}
+                        else:
+                            reply = {"result": await self._call(op, request)}
+                except Exception as exc:
+                    reply = {"error": f"{type(exc).__name__}: {exc}"}
+
+                self._send(writer, reply)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _call(self, op: str, request: dict[str, Any]) -> Any:
+        """Run a non-streaming request against the local client."""
+        if op == "generate":
+            return await self.client.agenerate(**request)
+        if op == "generate_batch":
+            return await asyncio.to_thread(self.client.generate_batch, **request)
+        if op == "info":
+            return self.client.get_model_info()
+        raise ValueError(f"Unknown op: {op}")
+
+    @staticmethod
+    def _send(writer: asyncio.StreamWriter, message: dict[str, Any]) -> None:
+        writer.write(json.dumps(message).encode() + b"\n")
+
+
+async def main(socket_path: Path | None = None) -> None:
+    """Load the model and serve it until cancelled."""
+    path = socket_path or settings.mlx_worker_socket or DEFAULT_SOCKET
+    path.unlink(missing_ok=True)
+
+    worker = MLXWorker()
+    await asyncio.to_thread(worker.client.load_model)
+
+    server = await asyncio.start_unix_server(worker.handle, path=str(path))
+    print(f"MLX worker serving {worker.client.config.model_path} on {path}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
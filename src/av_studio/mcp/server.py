@@ -2,229 +2,453 @@
 Model Context Protocol (MCP) server for extending studio capabilities.
 """
 
-import json
+import asyncio
+import sys
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from functools import cache, partial
+from hashlib import blake2b
+from operator import attrgetter
+from os import fspath
 from pathlib import Path
-from typing import Any
+from types import ModuleType
+from typing import TYPE_CHECKING, Any, Literal
 
+import orjson
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import TextContent, Tool
+from pydantic import BaseModel  # type: ignore[import-not-found,unused-ignore]
+
+if TYPE_CHECKING:
+    from av_studio.gateway.token_analyzer import CostCalculator, TokenAnalyzer, TokenCount
+    from av_studio.processing.audio.pipeline import AudioProcessor
 
 # Create MCP server
 app = Server("av-studio")
 
-@app.list_tools()  # type: ignore[untyped-decorator]
-async def list_tools() -> list[Tool]:
-    """List available tools."""
-    return [
-        Tool(
-            name="separate_stems",
-            description="Separate an audio file into stems (vocals, drums, bass, other)",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "audio_path": {
-                        "type": "string",
-                        "description": "Path to the audio file",
-                    },
-                    "model": {
-                        "type": "string",
-                        "enum": ["htdemucs", "htdemucs_ft", "mdx_extra"],
-                        "description": "Demucs model to use (htdemucs_ft recommended)",
-                        "default": "htdemucs_ft",
-                    },
+# Audio tools share the GPU and run one at a time off the event loop; the
+# light tools only get a cap so a burst cannot crowd out protocol I/O
+HEAVY_TOOL_CONCURRENCY = 1
+LIGHT_TOOL_CONCURRENCY = 8
+_heavy_sem = asyncio.Semaphore(HEAVY_TOOL_CONCURRENCY)
+_light_sem = asyncio.Semaphore(LIGHT_TOOL_CONCURRENCY)
+
+# Token counts kept for repeated analyze_cost calls on the same text
+TOKEN_CACHE_SIZE = 4096
+_token_counts: OrderedDict[tuple[str, bytes], "TokenCount"] = OrderedDict()
+
+
+def _jdumps(obj: Any) -> str:
+    """Serialize a tool response as indented JSON."""
+    return orjson.dumps(
+        obj, default=str, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+    ).decode()
+
+
+# Heavy subsystems are imported on first use, then served from the cache
+@cache
+def _audio() -> "AudioProcessor":
+    from av_studio.processing.audio.pipeline import audio_processor
+
+    return audio_processor
+
+
+@cache
+def _tokenizer() -> tuple["TokenAnalyzer", "CostCalculator"]:
+    from av_studio.gateway.token_analyzer import cost_calculator, token_analyzer
+
+    return token_analyzer, cost_calculator
+
+
+async def _count_tokens(text: str, model: str) -> "TokenCount":
+    """
+    Count tokens, reusing the result for text already seen.
+    Keyed on a digest of the text so the cache does not pin large prompts.
+    Tokenizing runs in a worker thread; the cache is only touched on the loop.
+    """
+    key = (model, blake2b(text.encode(), digest_size=16).digest())
+    tokens = _token_counts.get(key)
+    if tokens is not None:
+        _token_counts.move_to_end(key)
+        return tokens
+
+    tokens = await asyncio.to_thread(_tokenizer()[0].count_tokens, text, model)
+    _token_counts[key] = tokens
+    if len(_token_counts) > TOKEN_CACHE_SIZE:
+        _token_counts.popitem(last=False)
+    return tokens
+
+
+@cache
+def _router() -> ModuleType:
+    from av_studio.gateway import router
+
+    return router
+
+
+def _jstr(value: str) -> str:
+    """Encode one string as a JSON literal."""
+    return orjson.dumps(value).decode()
+
+
+# Fixed-shape responses are formatted straight into a template (laid out like
+# _jdumps output); only their strings go through the encoder
+_COST_TEMPLATE = """{{
+  "tokens": {{
+    "input_tokens": {input_tokens},
+    "estimated_output_tokens": {estimated_output_tokens},
+    "total_tokens": {total_tokens},
+    "cached_tokens": {cached_tokens},
+    "method": {method}
+  }},
+  "cost": {{
+    "input_cost": {input_cost},
+    "output_cost": {output_cost},
+    "total_cost": {total_cost},
+    "effective_cost": {effective_cost},
+    "currency": {currency},
+    "model": {model},
+    "breakdown": {breakdown}
+  }}
+}}"""
+_ROUTE_TEMPLATE = """{{
+  "model": {model},
+  "reason": {reason},
+  "estimated_cost": {estimated_cost},
+  "estimated_latency_ms": {estimated_latency_ms}
+}}"""
+
+
+# Schema fragments shared between tools
+_AUDIO_PATH_SCHEMA: dict[str, Any] = {"type": "string", "description": "Path to the audio file"}
+_AUDIO_PATHS_SCHEMA: dict[str, Any] = {
+    "oneOf": [_AUDIO_PATH_SCHEMA, {"type": "array", "items": _AUDIO_PATH_SCHEMA}],
+    "description": "Path to the audio file, or a list of paths",
+}
+
+# Tool definitions never change, so build them once at import
+_TOOLS: tuple[Tool, ...] = (
+    Tool(
+        name="separate_stems",
+        description="Separate an audio file into stems (vocals, drums, bass, other)",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "audio_path": _AUDIO_PATHS_SCHEMA,
+                "model": {
+                    "type": "string",
+                    "enum": ["htdemucs", "htdemucs_ft", "mdx_extra"],
+                    "description": "Demucs model to use (htdemucs_ft recommended)",
+                    "default": "htdemucs_ft",
+                },
+                "segment": {
+                    "type": "number",
+                    "description": "Demucs window length in seconds",
+                    "default": 7.8,
+                },
+                "overlap": {
+                    "type": "number",
+                    "description": "Fraction of each window shared with the next",
+                    "default": 0.1,
+                },
+                "batch_size": {
+                    "type": "integer",
+                    "description": "Windows per forward pass; lower it if memory runs out",
+                    "default": 4,
+                },
+                "engine": {
+                    "type": "string",
+                    "enum": ["torch", "onnx"],
+                    "description": "Inference engine; onnx is faster on CPU-only machines",
+                    "default": "torch",
                 },
-                "required": ["audio_path"],
             },
-        ),
-        Tool(
-            name="transcribe_audio",
-            description="Transcribe speech from an audio file to text",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "audio_path": {
-                        "type": "string",
-                        "description": "Path to the audio file",
-                    },
-                    "language": {
-                        "type": "string",
-                        "description": "Language code (e.g., 'en', 'es', 'fr')",
-                    },
+            "required": ["audio_path"],
+        },
+    ),
+    Tool(
+        name="transcribe_audio",
+        description="Transcribe speech from an audio file to text",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "audio_path": _AUDIO_PATHS_SCHEMA,
+                "language": {
+                    "type": "string",
+                    "description": "Language code (e.g., 'en', 'es', 'fr')",
                 },
-                "required": ["audio_path"],
             },
-        ),
-        Tool(
-            name="apply_audio_effects",
-            description="Apply audio effects like reverb, compression, EQ",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "audio_path": {"type": "string"},
-                    "effects": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "type": {
-                                    "type": "string",
-                                    "enum": ["reverb", "compressor", "gain", "lowpass", "highpass"],
-                                },
+            "required": ["audio_path"],
+        },
+    ),
+    Tool(
+        name="apply_audio_effects",
+        description="Apply audio effects like reverb, compression, EQ",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "audio_path": _AUDIO_PATH_SCHEMA,
+                "effects": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "type": {
+                                "type": "string",
+                                "enum": ["reverb", "compressor", "gain", "lowpass", "highpass"],
                             },
                         },
                     },
                 },
-                "required": ["audio_path", "effects"],
             },
-        ),
-        Tool(
-            name="analyze_cost",
-            description="Analyze token usage and cost for an LLM request",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "text": {"type": "string", "description": "Text to analyze"},
-                    "model": {"type": "string", "description": "Model to estimate for"},
-                },
-                "required": ["text"],
+            "required": ["audio_path", "effects"],
+        },
+    ),
+    Tool(
+        name="analyze_cost",
+        description="Analyze token usage and cost for an LLM request",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "text": {"type": "string", "description": "Text to analyze"},
+                "model": {"type": "string", "description": "Model to estimate for"},
             },
-        ),
-        Tool(
-            name="route_model",
-            description="Get smart routing recommendation for a task",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "task_type": {
-                        "type": "string",
-                        "enum": ["chat", "code", "audio_transcription", "creative_writing"],
-                    },
-                    "input_length": {"type": "integer"},
-                    "require_local": {"type": "boolean", "default": False},
+            "required": ["text"],
+        },
+    ),
+    Tool(
+        name="route_model",
+        description="Get smart routing recommendation for a task",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "task_type": {
+                    "type": "string",
+                    "enum": ["chat", "code", "audio_transcription", "creative_writing"],
                 },
-                "required": ["task_type"],
+                "input_length": {"type": "integer"},
+                "require_local": {"type": "boolean", "default": False},
             },
-        ),
-    ]
+            "required": ["task_type"],
+        },
+    ),
+)
 
 
-@app.call_tool()  # type: ignore[untyped-decorator]
-async def call_tool(name: str, arguments: dict[str, Any]) -> list[TextContent]:
-    """Execute a tool call."""
+@app.list_tools()  # type: ignore[untyped-decorator]
+async def list_tools() -> list[Tool]:
+    """List available tools."""
+    return list(_TOOLS)
 
-    if name == "separate_stems":
-        from av_studio.processing.audio.pipeline import audio_processor
 
-        result = audio_processor.separate_stems(
-            Path(arguments["audio_path"]),
-            model=arguments.get("model", "htdemucs_ft"),
-        )
-        return [
-            TextContent(
-                type="text",
-                text=json.dumps(
-                    {
-                        "vocals": str(result.vocals) if result.vocals else None,
-                        "drums": str(result.drums) if result.drums else None,
-                        "bass": str(result.bass) if result.bass else None,
-                        "other": str(result.other) if result.other else None,
-                        "model": result.model_used,
-                    },
-                    indent=2,
-                ),
-            )
-        ]
+# Tool arguments, validated once per call; they mirror the inputSchemas above
+class SeparateStemsArgs(BaseModel):  # type: ignore[misc]
+    audio_path: Path | list[Path]
+    model: Literal["htdemucs", "htdemucs_ft", "mdx_extra"] = "htdemucs_ft"
+    # Left unset so the processor's own defaults apply
+    segment: float | None = None
+    overlap: float | None = None
+    batch_size: int | None = None
+    engine: Literal["torch", "onnx"] | None = None
 
-    if name == "transcribe_audio":
-        from av_studio.processing.audio.pipeline import audio_processor
 
-        transcribe_result: dict[str, Any] = audio_processor.transcribe(
-            Path(arguments["audio_path"]),
-            language=arguments.get("language"),
-        )
-        return [TextContent(type="text", text=json.dumps(transcribe_result, indent=2))]
+class TranscribeArgs(BaseModel):  # type: ignore[misc]
+    audio_path: Path | list[Path]
+    language: str | None = None
+
+
+class EffectsArgs(BaseModel):  # type: ignore[misc]
+    audio_path: Path
+    effects: list[dict[str, Any]]
+
+
+class AnalyzeCostArgs(BaseModel):  # type: ignore[misc]
+    text: str
+    model: str = "gpt-4o"
+
+
+class RouteModelArgs(BaseModel):  # type: ignore[misc]
+    task_type: str
+    input_length: int = 1000
+    require_local: bool = False
+
+
+# Stem fields read off each StemSeparationResult in one C-level call
+_STEM_NAMES = ("vocals", "drums", "bass", "other")
+_stem_paths = attrgetter(*_STEM_NAMES)
+
+# Optional separate_stems arguments passed straight through to Demucs
+_DEMUCS_OPTIONS = frozenset({"segment", "overlap", "batch_size", "engine"})
+
+
+async def _run_audio_batch(fn: Callable[[Path], Any], audio_path: Path | list[Path]) -> list[Any]:
+    """
+    Run an audio tool over one path or a list of them.
+    The whole list holds the GPU semaphore once and runs in one worker thread
+    (map is consumed inside it), so loaded models stay warm between files.
+    """
+    paths = audio_path if isinstance(audio_path, list) else [audio_path]
+    async with _heavy_sem:
+        return await asyncio.to_thread(list, map(fn, paths))
+
+
+def _batch_response(audio_path: Path | list[Path], results: list[Any]) -> list[TextContent]:
+    """One JSON object for a single path, an array for a list of paths."""
+    body = results if isinstance(audio_path, list) else results[0]
+    return [TextContent(type="text", text=_jdumps(body))]
+
+
+async def _handle_separate_stems(arguments: dict[str, Any]) -> list[TextContent]:
+    """Separate one or more audio files into stems."""
+    args = SeparateStemsArgs.model_validate(arguments)
+    separate = partial(
+        _audio().separate_stems,
+        model=args.model,
+        **args.model_dump(include=_DEMUCS_OPTIONS, exclude_none=True),
+    )
+    results = await _run_audio_batch(separate, args.audio_path)
+    return _batch_response(
+        args.audio_path,
+        [
+            {
+                **{
+                    name: fspath(path) if path else None
+                    for name, path in zip(_STEM_NAMES, _stem_paths(result), strict=True)
+                },
+                "model": result.model_used,
+            }
+            for result in results
+        ],
+    )
 
-    if name == "apply_audio_effects":
-        from av_studio.processing.audio.pipeline import audio_processor
 
-        output_path = audio_processor.apply_effects(
-            Path(arguments["audio_path"]),
-            effects=arguments["effects"],
+async def _handle_transcribe(arguments: dict[str, Any]) -> list[TextContent]:
+    """Transcribe speech from one or more audio files."""
+    args = TranscribeArgs.model_validate(arguments)
+    transcribe = partial(_audio().transcribe, language=args.language)
+    return _batch_response(args.audio_path, await _run_audio_batch(transcribe, args.audio_path))
+
+
+async def _handle_effects(arguments: dict[str, Any]) -> list[TextContent]:
+    """Apply an effects chain to an audio file."""
+    args = EffectsArgs.model_validate(arguments)
+    async with _heavy_sem:
+        output_path = await asyncio.to_thread(
+            _audio().apply_effects, args.audio_path, effects=args.effects
         )
-        return [
-            TextContent(
-                type="text",
-                text=json.dumps(
-                    {
-                        "output_path": str(output_path),
-                        "effects_applied": len(arguments["effects"]),
-                    },
-                    indent=2,
-                ),
-            )
-        ]
+    return [
+        TextContent(
+            type="text",
+            text=_jdumps(
+                {
+                    "output_path": fspath(output_path),
+                    "effects_applied": len(args.effects),
+                }
+            ),
+        )
+    ]
 
-    if name == "analyze_cost":
-        from av_studio.gateway.token_analyzer import cost_calculator, token_analyzer
 
-        tokens = token_analyzer.count_tokens(
-            arguments["text"],
-            arguments.get("model", "gpt-4o"),
+async def _handle_cost(arguments: dict[str, Any]) -> list[TextContent]:
+    """Count tokens and estimate cost for a text."""
+    args = AnalyzeCostArgs.model_validate(arguments)
+    async with _light_sem:
+        tokens = await _count_tokens(args.text, args.model)
+        calculator = _tokenizer()[1]
+        # Only OpenAI models cache prompts automatically
+        cached_tokens = (
+            calculator.cacheable_prompt_tokens(tokens.input_tokens)
+            if tokens.method == "tiktoken"
+            else 0
         )
-        cost = cost_calculator.estimate_cost(
-            arguments.get("model", "gpt-4o"),
-            tokens.input_tokens,
-            tokens.estimated_output_tokens,
+        cost = calculator.estimate_cost(
+            args.model, tokens.input_tokens, tokens.estimated_output_tokens
         )
-        return [
-            TextContent(
-                type="text",
-                text=json.dumps(
-                    {
-                        "tokens": tokens.__dict__,
-                        "cost": cost.__dict__,
-                    },
-                    indent=2,
-                ),
-            )
-        ]
-
-    if name == "route_model":
-        from av_studio.gateway.router import TaskType, smart_router
-
-        decision = smart_router.route(
-            TaskType(arguments["task_type"]),
-            arguments.get("input_length", 1000),
-            require_local=arguments.get("require_local", False),
+        # List price stays in cost; effective_cost assumes a warm prompt cache
+        effective_cost = cost.total_cost
+        if cached_tokens:
+            effective_cost = calculator.estimate_cost(
+                args.model,
+                tokens.input_tokens,
+                tokens.estimated_output_tokens,
+                cached_input_tokens=cached_tokens,
+            ).total_cost
+    text = _COST_TEMPLATE.format(
+        input_tokens=tokens.input_tokens,
+        estimated_output_tokens=tokens.estimated_output_tokens,
+        total_tokens=tokens.total_tokens,
+        cached_tokens=cached_tokens,
+        method=_jstr(tokens.method),
+        input_cost=cost.input_cost,
+        output_cost=cost.output_cost,
+        total_cost=cost.total_cost,
+        effective_cost=effective_cost,
+        currency=_jstr(cost.currency),
+        model=_jstr(cost.model),
+        breakdown=_jdumps(cost.breakdown).replace("\n", "\n    "),
+    )
+    return [TextContent(type="text", text=text)]
+
+
+async def _handle_route(arguments: dict[str, Any]) -> list[TextContent]:
+    """Recommend a model for a task."""
+    args = RouteModelArgs.model_validate(arguments)
+    router = _router()
+    async with _light_sem:
+        # SmartRouter memoizes its selection per token bucket; cost and the
+        # context check use the exact length
+        decision = router.smart_router.route(
+            router.TaskType(args.task_type),
+            args.input_length,
+            require_local=args.require_local,
         )
-        return [
-            TextContent(
-                type="text",
-                text=json.dumps(
-                    {
-                        "model": decision.model_key,
-                        "reason": decision.reason,
-                        "estimated_cost": decision.estimated_cost,
-                        "estimated_latency_ms": decision.estimated_latency_ms,
-                    },
-                    indent=2,
-                ),
-            )
-        ]
+    text = _ROUTE_TEMPLATE.format(
+        model=_jstr(decision.model_key),
+        reason=_jstr(decision.reason),
+        estimated_cost=decision.estimated_cost,
+        estimated_latency_ms=decision.estimated_latency_ms,
+    )
+    return [TextContent(type="text", text=text)]
 
-    return [TextContent(type="text", text=f"Unknown tool: {name}")]
+
+# Tool name -> handler, one dict lookup per call
+_HANDLERS: dict[str, Callable[[dict[str, Any]], Awaitable[list[TextContent]]]] = {
+    "separate_stems": _handle_separate_stems,
+    "transcribe_audio": _handle_transcribe,
+    "apply_audio_effects": _handle_effects,
+    "analyze_cost": _handle_cost,
+    "route_model": _handle_route,
+}
+
+
+@app.call_tool()  # type: ignore[untyped-decorator]
+async def call_tool(name: str, arguments: dict[str, Any]) -> list[TextContent]:
+    """Execute a tool call."""
+    handler = _HANDLERS.get(name)
+    if handler is None:
+        return [TextContent(type="text", text=f"Unknown tool: {name}")]
+    return await handler(arguments)
+
+
+async def _warmup() -> None:
+    """Load Demucs before the first separate_stems call needs it."""
+    try:
+        # The processor's device lock makes a concurrent real call wait
+        await asyncio.to_thread(_audio().warmup, whisper_model=None)
+    except Exception as exc:
+        # Missing weights or backends surface again on the first real call
+        print(f"Audio warmup skipped: {exc}", file=sys.stderr)
 
 
 async def main() -> None:
     """Run the MCP server."""
+    # Warm up in the background so the handshake isn't delayed
+    warmup = asyncio.create_task(_warmup())
     async with stdio_server() as (read_stream, write_stream):
-        await app.run(
-            read_stream, write_stream, app.create_initialization_options()
-        )
+        await app.run(read_stream, write_stream, app.create_initialization_options())
+    warmup.cancel()
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(main())
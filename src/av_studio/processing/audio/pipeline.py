@@ -1,24 +1,370 @@
 """
 Audio processing pipeline optimized for M4 Max.
 Uses MPS (Metal) for GPU acceleration where possible.
+
+torch, torchaudio, Demucs and Pedalboard are imported on first use, so importing
+this module (or ``audio_processor``) stays cheap for processes that never touch
+audio.
 """
 
+import math
+import os
+import sys
+import threading
+from contextlib import ExitStack
 from dataclasses import dataclass
+from fractions import Fraction
+from functools import cache, partial
 from pathlib import Path
-from typing import Any, Literal
+from typing import TYPE_CHECKING, Any, Literal
+
+from av_studio.config.settings import settings
+
+if TYPE_CHECKING:
+    import numpy as np
+    import torch
+    from pedalboard import Pedalboard
+
+# Demucs inference settings: shifts=0 skips the random-shift ensemble (2x cost
+# per shift) and 7.8s matches the htdemucs training segment length.
+DEMUCS_SEGMENT_SECONDS = 7.8
+DEMUCS_OVERLAP = 0.1
+# Segments per Demucs forward pass
+DEMUCS_BATCH_SIZE = 4
+# Demucs graphs exported to ONNX, one file per model name (htdemucs.onnx, ...)
+DEMUCS_ONNX_DIR = settings.models_dir / "demucs"
+DEMUCS_ONNX_PROVIDERS = ("CUDAExecutionProvider", "CPUExecutionProvider")
+# ONNX exports carry no model metadata; these match the pretrained models
+DEMUCS_SOURCES = ("drums", "bass", "other", "vocals")
+DEMUCS_SAMPLE_RATE = 44100
+# Frames copied off the GPU and written per stem at a time
+STEM_WRITE_BLOCK_FRAMES = 1 << 18
+# Stem file formats: FLAC is lossless at roughly half the size of WAV, Opus is
+# transparent at 256 kbps for most downstream use
+StemFormat = Literal["wav", "flac", "opus"]
+# Bits per sample of FFmpeg sample formats (planar variants end in "p");
+# 24-bit sources decode as s32
+SAMPLE_FORMAT_BITS = {"u8": 8, "s16": 16, "s32": 32, "s64": 64, "flt": 32, "dbl": 64}
+DemucsEngine = Literal["torch", "onnx"]
+OPUS_BITRATE = 256_000
+# Frames streamed through Pedalboard per block
+EFFECTS_BLOCK_FRAMES = 65536
+# Distinct effect chains kept built between apply_effects calls
+EFFECTS_BOARD_CACHE_SIZE = 32
+# ITU-R BS.1770-4 gating: 400 ms blocks with 75% overlap
+LOUDNESS_BLOCK_SECONDS = 0.4
+LOUDNESS_BLOCK_OVERLAP = 0.75
+LOUDNESS_ABSOLUTE_GATE_LUFS = -70.0
+LOUDNESS_RELATIVE_GATE_LU = -10.0
+# Per-channel weights for L, R, C, Ls, Rs
+LOUDNESS_CHANNEL_WEIGHTS = (1.0, 1.0, 1.0, 1.41, 1.41)
+
+WhisperBackend = Literal["mlx", "whispercpp", "faster_whisper"]
+WhisperModelSize = Literal["tiny", "base", "small", "medium", "large-v3"]
+WhisperQuantization = Literal["fp16", "q8_0", "q5_0", "q4_0"]
+# Sub-4bpw quants are still being evaluated on Apple Silicon; opt-in only
+ExperimentalWhisperQuantization = Literal["q2_k", "iq4_nl"]
+
+# MLX-Whisper checkpoints per model size. large-v3 maps to the turbo variant,
+# which keeps the large-v3 encoder but prunes the decoder for real-time use.
+MLX_WHISPER_REPOS: dict[str, str] = {
+    "tiny": "mlx-community/whisper-tiny-mlx",
+    "base": "mlx-community/whisper-base-mlx",
+    "small": "mlx-community/whisper-small-mlx",
+    "medium": "mlx-community/whisper-medium-mlx",
+    "large-v3": "mlx-community/whisper-large-v3-turbo",
+}
+
+# mlx-community publishes 4-bit and 8-bit Whisper quants; q5_0 has no MLX
+# equivalent, so it maps to the nearest smaller one.
+MLX_WHISPER_QUANT_SUFFIXES: dict[str, str] = {
+    "fp16": "",
+    "q8_0": "-8bit",
+    "q5_0": "-q4",
+    "q4_0": "-q4",
+}
+
+# ggml checkpoints published for whisper.cpp per model size. The small models
+# ship q5_1 rather than q5_0; there is no q4_0 at any size and no large-v3 q8_0.
+WHISPERCPP_MODELS: dict[str, dict[str, str]] = {
+    "tiny": {"fp16": "tiny", "q8_0": "tiny-q8_0", "q5_0": "tiny-q5_1"},
+    "base": {"fp16": "base", "q8_0": "base-q8_0", "q5_0": "base-q5_1"},
+    "small": {"fp16": "small", "q8_0": "small-q8_0", "q5_0": "small-q5_1"},
+    "medium": {"fp16": "medium", "q8_0": "medium-q8_0", "q5_0": "medium-q5_0"},
+    "large-v3": {"fp16": "large-v3", "q5_0": "large-v3-q5_0"},
+}
+
+
+def whispercpp_model_name(model_size: str, quantization: str) -> str:
+    """Return the published ggml model name for a size/quant, or raise ValueError."""
+    published = WHISPERCPP_MODELS.get(model_size, {})
+    if quantization not in published:
+        raise ValueError(
+            f"No published whisper.cpp model for {model_size!r} at {quantization!r}; "
+            f"available quantizations: {', '.join(published) or 'none'}"
+        )
+    return published[quantization]
+
+
+@cache
+def get_device() -> "torch.device":
+    """Return the torch device for audio work, preferring MPS (Metal) on Apple Silicon."""
+    import torch
 
-import demucs.api
-import torch
-import torchaudio
-from pedalboard import Compressor, Gain, HighpassFilter, LowpassFilter, Pedalboard, Reverb
-from pedalboard.io import AudioFile
+    device = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
+    print(f"Audio pipeline using device: {device}", file=sys.stderr)
+    return device
+
+
+def default_whisper_backend() -> WhisperBackend:
+    """
+    Pick the fastest transcription backend for this machine.
+    MLX-Whisper runs the encoder on the Metal GPU; faster-whisper (CTranslate2)
+    has no MPS support, so it is only used as the x86/Linux fallback.
+    """
+    return "mlx" if get_device().type == "mps" else "faster_whisper"
+
+
+def _k_weighting_filters(sample_rate: int) -> list[tuple[list[float], list[float]]]:
+    """
+    Return (b, a) biquad coefficients for the BS.1770 K-weighting cascade:
+    a +4 dB high shelf at 1.5 kHz followed by a 38 Hz high-pass.
+    """
+    filters = []
+    for gain_db, q, fc, kind in ((4.0, 1 / math.sqrt(2), 1500.0, "shelf"), (0.0, 0.5, 38.0, "hp")):
+        a_gain = 10 ** (gain_db / 40)
+        w0 = 2 * math.pi * fc / sample_rate
+        cos_w0 = math.cos(w0)
+        alpha = math.sin(w0) / (2 * q)
+        if kind == "shelf":
+            sqrt_a = 2 * math.sqrt(a_gain) * alpha
+            b = [
+                a_gain * ((a_gain + 1) + (a_gain - 1) * cos_w0 + sqrt_a),
+                -2 * a_gain * ((a_gain - 1) + (a_gain + 1) * cos_w0),
+                a_gain * ((a_gain + 1) + (a_gain - 1) * cos_w0 - sqrt_a),
+            ]
+            a = [
+                (a_gain + 1) - (a_gain - 1) * cos_w0 + sqrt_a,
+                2 * ((a_gain - 1) - (a_gain + 1) * cos_w0),
+                (a_gain + 1) - (a_gain - 1) * cos_w0 - sqrt_a,
+            ]
+        else:
+            b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+            a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+        filters.append((b, a))
+    return filters
+
+
+def integrated_loudness(waveform: "torch.Tensor", sample_rate: int) -> float:
+    """
+    Measure integrated loudness (LUFS) of a (channels, samples) waveform.
+    Implements BS.1770-4 K-weighting and gating. The K-weighting biquads are
+    sequential IIR filters, which torchaudio only runs efficiently on the
+    CPU, so waveforms on other devices are measured from a CPU copy.
+    """
+    import torch
+    import torchaudio.functional as AF
+
+    waveform = waveform.cpu()
+    block = int(LOUDNESS_BLOCK_SECONDS * sample_rate)
+    if waveform.shape[-1] < block:
+        raise ValueError("Audio must be longer than the 400 ms loudness block")
+
+    filtered = waveform
+    for b, a in _k_weighting_filters(sample_rate):
+        filtered = AF.lfilter(
+            filtered,
+            torch.tensor(a, dtype=waveform.dtype, device=waveform.device),
+            torch.tensor(b, dtype=waveform.dtype, device=waveform.device),
+            clamp=False,
+        )
 
-# Ensure we're using MPS (Metal) on Apple Silicon
-DEVICE = torch.device("mps" if torch.backends.mps.is_available() else "cpu")
-print(f"Audio pipeline using device: {DEVICE}")
+    # Mean square per channel per gating block: (channels, blocks)
+    hop = int(block * (1 - LOUDNESS_BLOCK_OVERLAP))
+    power = filtered.unfold(-1, block, hop).pow(2).mean(-1)
+
+    weights = torch.tensor(
+        [
+            LOUDNESS_CHANNEL_WEIGHTS[c] if c < len(LOUDNESS_CHANNEL_WEIGHTS) else 1.0
+            for c in range(waveform.shape[0])
+        ],
+        dtype=waveform.dtype,
+        device=waveform.device,
+    )[:, None]
+    block_loudness = -0.691 + 10 * torch.log10((weights * power).sum(0))
+
+    gated = block_loudness >= LOUDNESS_ABSOLUTE_GATE_LUFS
+    relative_gate = (
+        -0.691
+        + 10 * torch.log10((weights * power[:, gated].mean(-1, keepdim=True)).sum())
+        + LOUDNESS_RELATIVE_GATE_LU
+    )
+    gated &= block_loudness > relative_gate
+
+    loudness = -0.691 + 10 * torch.log10((weights * power[:, gated].mean(-1, keepdim=True)).sum())
+    return float(loudness)
+
+
+def separate_batched(
+    model: Any,
+    mix: "torch.Tensor",
+    segment: float = DEMUCS_SEGMENT_SECONDS,
+    overlap: float = DEMUCS_OVERLAP,
+    batch_size: int = DEMUCS_BATCH_SIZE,
+) -> "torch.Tensor":
+    """
+    Separate a (channels, samples) mix into (sources, channels, samples).
+    Same overlap-add as demucs.apply.apply_model with shifts=0, but every
+    segment is padded to one length so batch_size segments share a single
+    forward pass instead of running one at a time. Call under inference_mode.
+    """
+    import torch
+    import torch.nn.functional as F
+
+    # BagOfModels (htdemucs_ft, mdx_extra): weighted average of its members
+    if hasattr(model, "models"):
+        totals = [0.0] * len(model.sources)
+        bag_out = mix.new_zeros(len(model.sources), *mix.shape)
+        for sub_model, weights in zip(model.models, model.weights, strict=True):
+            out = separate_batched(sub_model, mix, segment, overlap, batch_size)
+            for k, weight in enumerate(weights):
+                bag_out[k] += weight * out[k]
+                totals[k] += weight
+            del out
+        for k, total in enumerate(totals):
+            bag_out[k] /= total
+        return bag_out
+
+    device = mix.device if isinstance(model, OnnxDemucs) else next(model.parameters()).device
+    length = mix.shape[-1]
+    # HTDemucs cannot run past its training segment
+    segment = min(segment, float(getattr(model, "segment", segment)))
+    segment_length = int(model.samplerate * segment)
+    stride = int((1 - overlap) * segment_length)
+    padded_length = model.valid_length(segment_length)
+    offsets = range(0, length, stride)
+
+    # Triangular window for the overlap-add
+    window = torch.cat(
+        [
+            torch.arange(1, segment_length // 2 + 1),
+            torch.arange(segment_length - segment_length // 2, 0, -1),
+        ]
+    ).to(mix.device, torch.float32)
+    window /= window.max()
+
+    out = mix.new_zeros(len(model.sources), mix.shape[0], length)
+    sum_weight = mix.new_zeros(length)
+    for first in range(0, len(offsets), batch_size):
+        batch_offsets = offsets[first : first + batch_size]
+        chunks = []
+        for offset in batch_offsets:
+            # Centre each segment in real context from the mix, zero past the ends
+            chunk_length = min(segment_length, length - offset)
+            start = offset - (padded_length - chunk_length) // 2
+            end = start + padded_length
+            lo, hi = max(0, start), min(length, end)
+            chunks.append(F.pad(mix[..., lo:hi], (lo - start, end - hi)))
+        estimates = model(torch.stack(chunks).to(device)).to(mix.device)
+
+        for offset, estimate in zip(batch_offsets, estimates, strict=True):
+            chunk_length = min(segment_length, length - offset)
+            trim = (padded_length - chunk_length) // 2
+            weight = window[:chunk_length]
+            out[..., offset : offset + chunk_length] += (
+                weight * estimate[..., trim : trim + chunk_length]
+            )
+            sum_weight[offset : offset + chunk_length] += weight
+        del estimates
+
+    return out.div_(sum_weight)
+
+
+class OnnxDemucs:
+    """
+    A Demucs graph exported to ONNX, run through one shared InferenceSession.
+    Exposes the attributes separate_batched reads from a torch Demucs model.
+    The export takes a (batch, channels, samples) float32 mix with a dynamic
+    batch axis and returns (batch, sources, channels, samples).
+    """
+
+    samplerate = DEMUCS_SAMPLE_RATE
+    audio_channels = 2
+    sources = DEMUCS_SOURCES
+
+    def __init__(self, path: Path):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        # One op at a time, each spread across every core by MLAS/OpenMP
+        options.intra_op_num_threads = 0
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        available = ort.get_available_providers()
+        self._session = ort.InferenceSession(
+            str(path),
+            sess_options=options,
+            providers=[p for p in DEMUCS_ONNX_PROVIDERS if p in available],
+        )
+        mix_input = self._session.get_inputs()[0]
+        self._input_name = mix_input.name
+        # Exports traced at a fixed length only accept that many samples
+        samples = mix_input.shape[-1]
+        self._fixed_length = samples if isinstance(samples, int) else None
+        self.segment = samples / self.samplerate if self._fixed_length else math.inf
 
+    def valid_length(self, length: int) -> int:
+        """Samples each segment must be padded to before inference."""
+        return self._fixed_length or length
 
-@dataclass
+    def __call__(self, mix: "torch.Tensor") -> "torch.Tensor":
+        import torch
+
+        sources = self._session.run(None, {self._input_name: mix.float().cpu().numpy()})[0]
+        return torch.from_numpy(sources)
+
+
+class _OpusWriter:
+    """
+    Streaming Opus encoder with the same write()/context-manager interface as
+    pedalboard's AudioFile, which cannot encode Opus.
+    """
+
+    def __init__(self, path: Path, sample_rate: int, num_channels: int, bitrate: int):
+        import av
+
+        self._av = av
+        self._container = av.open(str(path), "w")
+        self._layout = "stereo" if num_channels == 2 else "mono"
+        # libopus only runs at 48 kHz; PyAV resamples frames on encode
+        self._stream = self._container.add_stream("libopus", rate=48000, layout=self._layout)
+        self._stream.bit_rate = bitrate
+        self._sample_rate = sample_rate
+        self._frames_written = 0
+
+    def write(self, samples: "np.ndarray") -> None:
+        """Encode a (channels, frames) float32 block."""
+        frame = self._av.AudioFrame.from_ndarray(samples, format="fltp", layout=self._layout)
+        frame.sample_rate = self._sample_rate
+        frame.pts = self._frames_written
+        frame.time_base = Fraction(1, self._sample_rate)
+        self._frames_written += samples.shape[-1]
+        self._container.mux(self._stream.encode(frame))
+
+    def close(self) -> None:
+        """Flush the encoder and finalize the file."""
+        self._container.mux(self._stream.encode(None))
+        self._container.close()
+
+    def __enter__(self) -> "_OpusWriter":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+@dataclass(slots=True, frozen=True)
 class AudioMetadata:
     """Metadata for an audio file."""
 
@@ -29,7 +375,7 @@ class AudioMetadata:
     bit_depth: int | None = None
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class StemSeparationResult:
     """Result of stem separation."""
 
@@ -46,56 +392,169 @@ class AudioProcessor:
     Comprehensive audio processing using M4 Max GPU acceleration.
     """
 
-    def __init__(self, output_dir: Path):
+    def __init__(
+        self,
+        output_dir: Path,
+        whisper_backend: WhisperBackend | None = None,
+        preload_whisper: WhisperModelSize | None = None,
+        allow_experimental_quants: bool = False,
+        half_precision: bool | None = None,
+    ):
         self.output_dir = output_dir
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        self._demucs_separator: Any = None
+        self._whisper_backend = whisper_backend
+        self.allow_experimental_quants = allow_experimental_quants
+        self._half_precision = half_precision
+        self._demucs_by_name: dict[str, Any] = {}
+        self._onnx_demucs_by_name: dict[str, OnnxDemucs] = {}
+        self._whisper_models: dict[tuple[str, str, str], Any] = {}
+        # Each cached board carries filter state, so it is paired with a lock
+        # held for the whole reset-and-process pass over one file.
+        self._board_cache: dict[tuple[Any, ...], tuple[Pedalboard, threading.Lock]] = {}
+        self._board_cache_lock = threading.Lock()
+        # Callers may run jobs from worker threads; decode and file I/O overlap
+        # freely but model loads and inference run one at a time.
+        self._gpu_lock = threading.Lock()
+
+        # Load the model up front so the first request doesn't pay load time
+        if preload_whisper is not None:
+            self._get_whisper(self.whisper_backend, preload_whisper, "q5_0")
+
+    @property
+    def whisper_backend(self) -> WhisperBackend:
+        """Transcription backend, auto-selected for this machine unless given."""
+        if self._whisper_backend is None:
+            self._whisper_backend = default_whisper_backend()
+        return self._whisper_backend
+
+    @property
+    def half_precision(self) -> bool:
+        """
+        Whether Demucs runs under fp16 autocast. Defaults to on for MPS, where
+        fp16 halves weight/activation bandwidth; autocast keeps STFT, norms and
+        softmax in fp32.
+        """
+        if self._half_precision is None:
+            self._half_precision = get_device().type == "mps"
+        return self._half_precision
 
     def get_metadata(self, audio_path: Path) -> AudioMetadata:
         """Extract metadata from an audio file."""
-        info = torchaudio.info(str(audio_path))
+        from torchcodec.decoders import AudioDecoder
+
+        metadata = AudioDecoder(str(audio_path)).metadata
         return AudioMetadata(
-            sample_rate=info.sample_rate,
-            channels=info.num_channels,
-            duration_seconds=info.num_frames / info.sample_rate,
+            sample_rate=metadata.sample_rate,
+            channels=metadata.num_channels,
+            duration_seconds=metadata.duration_seconds_from_header
+            or metadata.duration_seconds
+            or 0.0,
             format=audio_path.suffix.lstrip("."),
-            bit_depth=info.bits_per_sample,
+            bit_depth=SAMPLE_FORMAT_BITS.get((metadata.sample_format or "").rstrip("p")),
+        )
+
+    def _load(
+        self, audio_path: Path, start: float = 0.0, duration: float | None = None
+    ) -> tuple["torch.Tensor", int]:
+        """
+        Decode a window of an audio file into a CPU tensor.
+        Only the requested frames are decoded; tensors stay on the CPU until
+        they are about to enter a GPU op. duration=None decodes to the end.
+        """
+        from torchcodec.decoders import AudioDecoder
+
+        if duration is not None and duration <= 0:
+            raise ValueError(f"duration must be positive, got {duration}")
+
+        samples = AudioDecoder(str(audio_path)).get_samples_played_in_range(
+            start_seconds=start,
+            stop_seconds=None if duration is None else start + duration,
         )
+        return samples.data, samples.sample_rate
 
     def separate_stems(
         self,
         audio_path: Path,
         model: Literal["htdemucs", "htdemucs_ft", "mdx_extra"] = "htdemucs_ft",
+        start_sec: float = 0.0,
+        duration_sec: float | None = None,
+        stem_format: StemFormat = "flac",
+        segment: float = DEMUCS_SEGMENT_SECONDS,
+        overlap: float = DEMUCS_OVERLAP,
+        batch_size: int = DEMUCS_BATCH_SIZE,
+        engine: DemucsEngine = "torch",
     ) -> StemSeparationResult:
         """
         Separate audio into stems (vocals, drums, bass, other).
         Uses Demucs with MPS acceleration.
 
         htdemucs_ft is the fine-tuned model with best quality.
+        Stems are copied off the GPU and written block by block, so only one
+        block of host memory is needed per stem regardless of track length.
+        Pass start_sec/duration_sec to separate only a window of the file.
+        Stems are written as 24-bit FLAC by default; "wav" keeps the legacy
+        16-bit PCM output and "opus" writes 256 kbps Ogg Opus.
+        segment/overlap control the Demucs windows and batch_size how many
+        windows share a forward pass; lower it if the device runs out of memory.
+        engine="onnx" runs an ONNX Runtime export of the model from
+        DEMUCS_ONNX_DIR instead, which is much faster on CPU-only machines.
         """
-        # Initialize separator if needed
-        if self._demucs_separator is None or self._demucs_separator.model != model:
-            self._demucs_separator = demucs.api.Separator(
-                model=model,
-                device=DEVICE,
+        import torch
+        from demucs.audio import convert_audio
+
+        device = get_device()
+        waveform, sample_rate = self._load(audio_path, start_sec, duration_sec)
+        with self._gpu_lock:
+            demucs_model = (
+                self._get_onnx_demucs(model) if engine == "onnx" else self._get_demucs(model)
             )
-
-        # Perform separation
-        origin, separated = self._demucs_separator.separate_audio_file(str(audio_path))
+        wav = convert_audio(
+            waveform, sample_rate, demucs_model.samplerate, demucs_model.audio_channels
+        )
+        del waveform
+
+        # Demucs expects input normalized by the mono reference signal
+        ref = wav.mean(0)
+        ref_mean, ref_std = ref.mean(), ref.std() + 1e-8
+        wav = (wav - ref_mean) / ref_std
+
+        with (
+            self._gpu_lock,
+            torch.inference_mode(),
+            torch.autocast(
+                device_type=device.type,
+                dtype=torch.float16,
+                enabled=self.half_precision and engine == "torch",
+            ),
+        ):
+            sources = separate_batched(demucs_model, wav, segment, overlap, batch_size)
+            # In-place ops on inference tensors are only allowed inside the mode
+            sources = sources.float().mul_(ref_std).add_(ref_mean)
+        del wav
 
         # Save stems
         stem_dir = self.output_dir / audio_path.stem / "stems"
         stem_dir.mkdir(parents=True, exist_ok=True)
 
-        stem_paths = {}
-        for stem_name, stem_audio in separated.items():
-            stem_path = stem_dir / f"{stem_name}.wav"
-            demucs.api.save_audio(
-                stem_audio,
-                str(stem_path),
-                samplerate=self._demucs_separator.samplerate,
-            )
-            stem_paths[stem_name] = stem_path
+        stem_paths = {name: stem_dir / f"{name}.{stem_format}" for name in demucs_model.sources}
+        with ExitStack() as stack:
+            writers = [
+                stack.enter_context(
+                    self._open_stem_writer(
+                        stem_paths[name],
+                        demucs_model.samplerate,
+                        demucs_model.audio_channels,
+                        stem_format,
+                    )
+                )
+                for name in demucs_model.sources
+            ]
+            for start in range(0, sources.shape[-1], STEM_WRITE_BLOCK_FRAMES):
+                block = sources[..., start : start + STEM_WRITE_BLOCK_FRAMES].cpu().numpy()
+                for writer, stem_block in zip(writers, block, strict=True):
+                    writer.write(stem_block)
+                del block
+        del sources
 
         return StemSeparationResult(
             vocals=stem_paths.get("vocals"),
@@ -106,6 +565,84 @@ class AudioProcessor:
             model_used=model,
         )
 
+    def _open_stem_writer(
+        self, path: Path, sample_rate: int, num_channels: int, stem_format: StemFormat
+    ) -> Any:
+        """Open a streaming writer for one stem in the requested format."""
+        if stem_format == "opus":
+            return _OpusWriter(path, sample_rate, num_channels, OPUS_BITRATE)
+
+        from pedalboard.io import AudioFile
+
+        return AudioFile(
+            str(path),
+            "w",
+            sample_rate,
+            num_channels,
+            bit_depth=24 if stem_format == "flac" else 16,
+        )
+
+    def _get_demucs(self, model: str) -> Any:
+        """
+        Load a pretrained Demucs model onto the device, caching it by name.
+
+        htdemucs' transformer layers are nn.MultiheadAttention called with
+        need_weights=False, which PyTorch dispatches to the fused
+        scaled_dot_product_attention kernel (Metal on MPS) as long as autograd
+        is off, so inference must run under inference_mode/no_grad.
+        """
+        if model not in self._demucs_by_name:
+            from demucs.pretrained import get_model
+
+            self._demucs_by_name[model] = get_model(model).to(get_device()).eval()
+        return self._demucs_by_name[model]
+
+    def _get_onnx_demucs(self, model: str) -> OnnxDemucs:
+        """Open the ONNX export of a Demucs model once and share its session."""
+        if model not in self._onnx_demucs_by_name:
+            path = DEMUCS_ONNX_DIR / f"{model}.onnx"
+            if not path.exists():
+                raise FileNotFoundError(f"No ONNX export of {model} at {path}")
+            self._onnx_demucs_by_name[model] = OnnxDemucs(path)
+        return self._onnx_demucs_by_name[model]
+
+    def warmup(
+        self,
+        demucs_model: str = "htdemucs_ft",
+        whisper_model: WhisperModelSize | None = "large-v3",
+        quantization: WhisperQuantization = "q5_0",
+    ) -> None:
+        """
+        Run one second of silence through Demucs and Whisper.
+        Loads weights and primes Metal kernels and CT2/MLX caches so the first
+        user request doesn't pay for them. Pass whisper_model=None to warm up
+        Demucs only. Each model warms under the device lock, so a real request
+        arriving meanwhile waits for it rather than racing it.
+        """
+        import numpy as np
+        import torch
+
+        with self._gpu_lock, torch.inference_mode():
+            separator = self._get_demucs(demucs_model)
+            silence = torch.zeros(separator.audio_channels, separator.samplerate)
+            separate_batched(separator, silence)
+
+        if whisper_model is None:
+            return
+
+        # Whisper models consume 16 kHz mono float32
+        backend = self.whisper_backend
+        speech = np.zeros(16000, dtype=np.float32)
+        with self._gpu_lock:
+            whisper = self._get_whisper(backend, whisper_model, quantization)
+            if backend == "mlx":
+                whisper(speech)
+            elif backend == "whispercpp":
+                whisper.transcribe(speech)
+            else:
+                segments, _ = whisper.transcribe(speech)
+                list(segments)  # Segments are decoded lazily
+
     def apply_effects(
         self,
         audio_path: Path,
@@ -122,56 +659,175 @@ class AudioProcessor:
             {"type": "gain", "gain_db": 3},
         ]
         """
-        # Build pedalboard
+        from pedalboard.io import AudioFile
+
+        board, board_lock = self._get_board(effects)
+
+        # Process audio block by block; reset=False carries effect state
+        # (reverb tails, filter history) across block boundaries
+        output_path = output_path or self.output_dir / f"{audio_path.stem}_processed.wav"
+
+        with board_lock, AudioFile(str(audio_path)) as f:
+            board.reset()  # Clear tails left over from the previous file
+            with AudioFile(str(output_path), "w", f.samplerate, f.num_channels) as out:
+                while f.tell() < f.frames:
+                    chunk = f.read(EFFECTS_BLOCK_FRAMES)
+                    out.write(board.process(chunk, f.samplerate, reset=False))
+
+        return output_path
+
+    def _get_board(self, effects: list[dict[str, Any]]) -> tuple["Pedalboard", threading.Lock]:
+        """
+        Build a Pedalboard for an effects chain, reusing one built for the same chain.
+
+        Returns the board with the lock that must be held while it processes audio.
+        """
+        key = tuple(tuple(sorted(effect.items())) for effect in effects)
+        with self._board_cache_lock:
+            if key in self._board_cache:
+                return self._board_cache[key]
+
+        from pedalboard import Compressor, Gain, HighpassFilter, LowpassFilter, Pedalboard, Reverb
+
         board = Pedalboard()
 
         for effect in effects:
-            effect_type = effect.pop("type")
+            params = {k: v for k, v in effect.items() if k != "type"}
+            effect_type = effect["type"]
             if effect_type == "reverb":
-                board.append(Reverb(**effect))
+                board.append(Reverb(**params))
             elif effect_type == "compressor":
-                board.append(Compressor(**effect))
+                board.append(Compressor(**params))
             elif effect_type == "gain":
-                board.append(Gain(**effect))
+                board.append(Gain(**params))
             elif effect_type == "lowpass":
-                board.append(LowpassFilter(**effect))
+                board.append(LowpassFilter(**params))
             elif effect_type == "highpass":
-                board.append(HighpassFilter(**effect))
+                board.append(HighpassFilter(**params))
 
-        # Process audio
-        output_path = output_path or self.output_dir / f"{audio_path.stem}_processed.wav"
-
-        with AudioFile(str(audio_path)) as f:
-            audio = f.read(f.frames)
-            sample_rate = f.samplerate
-
-        processed = board(audio, sample_rate)
-
-        with AudioFile(str(output_path), "w", sample_rate, processed.shape[0]) as f:
-            f.write(processed)
-
-        return output_path
+        with self._board_cache_lock:
+            # Another thread may have built the same chain meanwhile; keep theirs
+            if key not in self._board_cache:
+                if len(self._board_cache) >= EFFECTS_BOARD_CACHE_SIZE:
+                    self._board_cache.pop(next(iter(self._board_cache)))
+                self._board_cache[key] = (board, threading.Lock())
+            return self._board_cache[key]
 
     def transcribe(
         self,
         audio_path: Path,
-        model_size: Literal["tiny", "base", "small", "medium", "large-v3"] = "large-v3",
+        model_size: WhisperModelSize = "large-v3",
         language: str | None = None,
+        backend: WhisperBackend | None = None,
+        quantization: WhisperQuantization | ExperimentalWhisperQuantization = "q5_0",
     ) -> dict[str, Any]:
         """
-        Transcribe audio using faster-whisper with GPU acceleration.
+        Transcribe audio using Whisper.
+
+        On Apple Silicon this runs MLX-Whisper (or whisper.cpp with Metal) so the
+        encoder matmuls execute on the GPU. faster-whisper is kept as the CPU
+        fallback for x86/Linux hosts.
+
+        Weights default to Q5_0, which roughly halves the memory streamed per
+        decoded token compared to FP16. q2_k/iq4_nl require
+        ``allow_experimental_quants``.
         """
-        from faster_whisper import WhisperModel
+        if quantization in ("q2_k", "iq4_nl") and not self.allow_experimental_quants:
+            raise ValueError(
+                f"Quantization {quantization!r} is experimental; "
+                "enable allow_experimental_quants to use it"
+            )
 
-        # faster-whisper doesn't support MPS yet, so we use CPU with optimizations
-        # For M4 Max, the CPU is fast enough for most use cases
-        model = WhisperModel(
-            model_size,
-            device="cpu",  # MPS not yet supported
-            compute_type="int8",  # Optimized for Apple Silicon
-            cpu_threads=14,  # Use most of the 14 cores
-        )
+        backend = backend or self.whisper_backend
+        if backend == "whispercpp":
+            whispercpp_model_name(model_size, quantization)  # Fail before loading anything
+        with self._gpu_lock:
+            model = self._get_whisper(backend, model_size, quantization)
+            if backend == "mlx":
+                return self._transcribe_mlx(model, audio_path, language)
+            if backend == "whispercpp":
+                return self._transcribe_whispercpp(model, audio_path, language)
+            return self._transcribe_faster_whisper(model, audio_path, language)
+
+    def _get_whisper(
+        self, backend: WhisperBackend, model_size: WhisperModelSize, quantization: str
+    ) -> Any:
+        """Load a Whisper model for the given backend, caching it for reuse."""
+        key = (backend, model_size, quantization)
+        if key in self._whisper_models:
+            return self._whisper_models[key]
+
+        model: Any
+        if backend == "mlx":
+            import mlx.core as mx
+            import mlx_whisper
+            from mlx_whisper.transcribe import ModelHolder
+
+            # mlx_whisper keeps its own model cache; warm it and keep a
+            # transcribe function bound to the checkpoint
+            suffix = MLX_WHISPER_QUANT_SUFFIXES.get(quantization, "-q4")
+            repo = MLX_WHISPER_REPOS[model_size] + suffix
+            ModelHolder.get_model(repo, mx.float16)
+            model = partial(mlx_whisper.transcribe, path_or_hf_repo=repo, word_timestamps=False)
+        elif backend == "whispercpp":
+            from pywhispercpp.model import Model
+
+            # e.g. "large-v3-q5_0" -> ggml-large-v3-q5_0.bin, fetched on first use
+            model_name = whispercpp_model_name(model_size, quantization)
+            model = Model(model_name, n_threads=os.cpu_count(), use_gpu=True)
+        else:
+            from faster_whisper import WhisperModel
+
+            # CTranslate2 has no sub-8-bit CPU kernels, so every quant maps to int8
+            model = WhisperModel(
+                model_size,
+                device="cpu",  # CTranslate2 has no MPS backend
+                compute_type="float32" if quantization == "fp16" else "int8",
+                cpu_threads=os.cpu_count() or 4,
+            )
+
+        self._whisper_models[key] = model
+        return model
+
+    def _transcribe_mlx(
+        self, transcribe: Any, audio_path: Path, language: str | None
+    ) -> dict[str, Any]:
+        """Transcribe with MLX-Whisper on the Metal GPU."""
+        result = transcribe(str(audio_path), language=language)
+
+        transcript_segments = [
+            {"start": segment["start"], "end": segment["end"], "text": segment["text"]}
+            for segment in result["segments"]
+        ]
+        return {
+            "text": " ".join(segment["text"] for segment in transcript_segments),
+            "segments": transcript_segments,
+            "language": result.get("language", language),
+            "duration": self.get_metadata(audio_path).duration_seconds,
+        }
+
+    def _transcribe_whispercpp(
+        self, model: Any, audio_path: Path, language: str | None
+    ) -> dict[str, Any]:
+        """Transcribe with whisper.cpp using its Metal backend."""
+        segments = model.transcribe(str(audio_path), language=language or "auto")
 
+        # whisper.cpp reports timestamps in centiseconds
+        transcript_segments = [
+            {"start": segment.t0 / 100, "end": segment.t1 / 100, "text": segment.text}
+            for segment in segments
+        ]
+        return {
+            "text": " ".join(segment["text"] for segment in transcript_segments),
+            "segments": transcript_segments,
+            "language": language,
+            "duration": self.get_metadata(audio_path).duration_seconds,
+        }
+
+    def _transcribe_faster_whisper(
+        self, model: Any, audio_path: Path, language: str | None
+    ) -> dict[str, Any]:
+        """Transcribe with faster-whisper on the CPU."""
         segments, info = model.transcribe(
             str(audio_path),
             language=language,
@@ -205,30 +861,48 @@ class AudioProcessor:
         audio_path: Path,
         target_lufs: float = -14.0,  # Standard streaming loudness
         output_path: Path | None = None,
+        start_sec: float = 0.0,
+        duration_sec: float | None = None,
     ) -> Path:
-        """Normalize audio to target LUFS loudness."""
-        import pyloudnorm as pyln
+        """
+        Normalize audio to target LUFS loudness.
+        Loudness is measured on the CPU and the gain applied in place, so the
+        waveform is never copied for measuring or saving.
+        """
+        import torchaudio
 
-        waveform, sample_rate = torchaudio.load(str(audio_path))
-        audio_np = waveform.numpy().T  # Convert to (samples, channels)
+        waveform, sample_rate = self._load(audio_path, start_sec, duration_sec)
 
         # Measure current loudness
-        meter = pyln.Meter(sample_rate)
-        current_loudness = meter.integrated_loudness(audio_np)
+        current_loudness = integrated_loudness(waveform, sample_rate)
 
-        # Normalize
-        normalized = pyln.normalize.loudness(audio_np, current_loudness, target_lufs)
+        # Normalize (silence gates out every block; leave it untouched)
+        if math.isfinite(current_loudness):
+            waveform.mul_(10 ** ((target_lufs - current_loudness) / 20))
 
         # Save
         output_path = output_path or self.output_dir / f"{audio_path.stem}_normalized.wav"
-        torchaudio.save(
-            str(output_path),
-            torch.from_numpy(normalized.T),
-            sample_rate,
-        )
+        torchaudio.save(str(output_path), waveform, sample_rate)
 
         return output_path
 
 
-# Global processor instance
-audio_processor = AudioProcessor(Path.home() / "av-studio" / "processed")
+def __getattr__(name: str) -> Any:
+    """
+    Build module-level singletons on first access (PEP 562).
+
+    ``audio_processor`` is the global processor instance. Set
+    AV_PRELOAD_WHISPER=1 to load the default Whisper model when it is created
+    instead of on the first transcription. ``DEVICE`` is kept for callers that
+    imported the old module constant.
+    """
+    if name == "audio_processor":
+        processor = AudioProcessor(
+            Path.home() / "av-studio" / "processed",
+            preload_whisper="large-v3" if os.environ.get("AV_PRELOAD_WHISPER") == "1" else None,
+        )
+        globals()["audio_processor"] = processor
+        return processor
+    if name == "DEVICE":
+        return get_device()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,156 @@
+"""Test agent orchestration that runs without a loaded model."""
+
+import asyncio
+import hashlib
+import json
+from pathlib import Path
+from typing import Any
+
+from av_studio.agents import orchestrator
+from av_studio.agents.orchestrator import AgentRole, BaseAgent, CoordinatorAgent, Task
+from av_studio.gateway.router import TaskType
+from av_studio.processing.audio.pipeline import StemSeparationResult
+
+AUDIO_PLAN = json.dumps({"tasks": [{"agent": "AUDIO", "action": "inspect", "params": {}}]})
+
+
+class FakeLLM:
+    """Answers every prompt with a canned reply and records the prompts."""
+
+    def __init__(self, reply: str = AUDIO_PLAN) -> None:
+        self.reply = reply
+        self.prompts: list[str] = []
+
+    async def submit(self, prompt: str, system_prompt: str | None = None) -> str:
+        self.prompts.append(prompt)
+        return self.reply
+
+
+class RecordingAgent(BaseAgent):
+    """Audio agent that records the tasks routed to it."""
+
+    def __init__(self, llm: FakeLLM) -> None:
+        super().__init__(AgentRole.AUDIO, llm)  # type: ignore[arg-type]
+        self.tasks: list[Task] = []
+
+    def _get_system_prompt(self) -> str:
+        return "audio"
+
+    async def process(self, task: Task) -> Any:
+        self.tasks.append(task)
+        return {"text": "ok"}
+
+
+def _coordinator() -> tuple[CoordinatorAgent, FakeLLM, RecordingAgent]:
+    llm = FakeLLM()
+    coordinator = CoordinatorAgent(llm)  # type: ignore[arg-type]
+    agent = RecordingAgent(llm)
+    coordinator.register_agent(agent)
+    return coordinator, llm, agent
+
+
+def test_user_task_id_is_stable_content_hash():
+    """Test that a request maps to the same blake2b-derived ID every time."""
+    coordinator, _, agent = _coordinator()
+    for request in ("master this track", "master this track", "mix this track"):
+        asyncio.run(coordinator.handle_user_request(request))
+
+    digest = hashlib.blake2b(b"master this track", digest_size=8).hexdigest()
+    ids = [task.id for task in agent.tasks]
+    assert ids[0] == ids[1] == f"user_{digest}_0"
+    assert ids[2] != ids[0]
+
+
+def test_local_plan_skips_llm_for_audio_with_path():
+    """Test that a transcription with a supplied file is routed without the LLM."""
+    coordinator, llm, agent = _coordinator()
+    params = {"audio_path": "take.wav"}
+    task = Task(
+        id="t", description="transcribe", task_type=TaskType.AUDIO_TRANSCRIPTION, parameters=params
+    )
+
+    result = asyncio.run(coordinator.process(task))
+
+    assert llm.prompts == []
+    assert result["plan"]["tasks"] == [{"agent": "AUDIO", "action": "transcribe", "params": params}]
+    assert agent.tasks[0].description == "transcribe"
+
+
+def test_local_plan_needs_audio_path_and_agent():
+    """Test that the LLM is still used when the local plan lacks inputs."""
+    coordinator, _, _ = _coordinator()
+    task = Task(id="t", description="separate", task_type=TaskType.AUDIO_GENERATION)
+    assert coordinator._local_plan(task) is None
+
+    task.parameters["audio_path"] = "take.wav"
+    assert coordinator._local_plan(task) is not None
+    assert CoordinatorAgent(FakeLLM())._local_plan(task) is None  # type: ignore[arg-type]
+
+
+def test_plan_cache_reuses_llm_plan():
+    """Test that a repeated task is routed from the cache."""
+    coordinator, llm, agent = _coordinator()
+    for _ in range(2):
+        asyncio.run(
+            coordinator.process(Task(id="t", description="Mix it", task_type=TaskType.CHAT))
+        )
+
+    assert len(llm.prompts) == 1
+    assert len(agent.tasks) == 2
+
+
+def test_plan_cache_evicts_oldest(monkeypatch):
+    """Test that the cache drops its oldest plan once full."""
+    monkeypatch.setattr(orchestrator, "PLAN_CACHE_SIZE", 2)
+    coordinator, llm, _ = _coordinator()
+    for description in ("first", "second", "third", "first"):
+        asyncio.run(
+            coordinator.process(Task(id="t", description=description, task_type=TaskType.CHAT))
+        )
+
+    assert len(llm.prompts) == 4
+    assert [key[1] for key in coordinator._plan_cache] == ["third", "first"]
+
+
+def test_infer_task_type_priority():
+    """Test that the earliest keyword group wins regardless of position in the text."""
+    coordinator, _, _ = _coordinator()
+    assert coordinator._infer_task_type("Separate the stems, then transcribe") == (
+        TaskType.AUDIO_TRANSCRIPTION
+    )
+    assert coordinator._infer_task_type("write a scene") == TaskType.VIDEO_ANALYSIS
+    assert coordinator._infer_task_type("Isolate the DRUMS") == TaskType.AUDIO_GENERATION
+    assert coordinator._infer_task_type("compose a jingle") == TaskType.CREATIVE_WRITING
+    assert coordinator._infer_task_type("hello there") == TaskType.CHAT
+
+
+def test_summarize_stem_result_lists_written_stems():
+    """Test that stem results list only the stems that were written."""
+    coordinator, _, _ = _coordinator()
+    result = StemSeparationResult(
+        vocals=Path("v.wav"),
+        drums=Path("d.wav"),
+        bass=None,
+        other=None,
+        original=Path("mix.wav"),
+        model_used="htdemucs",
+    )
+    assert coordinator._summarize_result(result) == (
+        "stems written (htdemucs): vocals=v.wav, drums=d.wav"
+    )
+
+
+def test_summarize_nested_results():
+    """Test errors, transcripts and subtask lists are summarized compactly."""
+    coordinator, _, _ = _coordinator()
+    transcript = {"text": "la" * 500, "segments": [{}, {}], "language": "en", "duration": 3.0}
+    summary = coordinator._summarize_result(
+        {"plan": {}, "results": [{"error": "Audio file not found: x.wav"}, transcript]}
+    )
+
+    error, transcript_line = summary.split("; ")
+    assert error == "error: Audio file not found: x.wav"
+    assert transcript_line.startswith("transcript[en] 2 segments, 3.0s: 'lala")
+    assert len(transcript_line) < orchestrator.SUMMARY_TEXT_CHARS + 50
+    assert coordinator._summarize_result({"results": []}) == "no subtasks were run"
+    assert coordinator._summarize_result("x" * 1000) == "x" * orchestrator.SUMMARY_TEXT_CHARS
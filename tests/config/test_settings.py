@@ -1,5 +1,5 @@
 """Test configuration settings module."""
-from av_studio.config.settings import ModelProvider, Settings
+from av_studio.config.settings import ModelProvider, Settings, get_settings, settings
 
 
 def test_settings_default():
@@ -11,6 +11,12 @@ def test_settings_default():
     assert settings.port == 8000
 
 
+def test_get_settings_returns_shared_instance():
+    """Test that settings are validated once per process."""
+    assert get_settings() is get_settings()
+    assert get_settings() is settings
+
+
 def test_model_provider_enum():
     """Test ModelProvider enum values."""
     assert ModelProvider.OLLAMA == "ollama"
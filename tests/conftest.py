@@ -10,11 +10,28 @@ def test_data_dir():
     return Path(__file__).parent / "data"
 
 
+# 44-byte RIFF header: 16-bit PCM, 44.1 kHz, mono, 44100 frames (1 s)
+WAV_HEADER = bytes.fromhex(
+    "52494646ac580100"  # "RIFF", chunk size 88236
+    "57415645666d7420"  # "WAVE", "fmt "
+    "1000000001000100"  # fmt size 16, PCM, 1 channel
+    "44ac000088580100"  # 44100 Hz, 88200 bytes/s
+    "0200100064617461"  # block align 2, 16 bits, "data"
+    "88580100"  # data size 88200
+)
+
+
+@pytest.fixture(scope="session")
+def silent_wav_bytes():
+    """Return one second of silent WAV audio, built once per session."""
+    return WAV_HEADER + bytes(88200)
+
+
 @pytest.fixture
-def temp_audio_file(tmp_path):
+def temp_audio_file(tmp_path, silent_wav_bytes):
     """Create a temporary audio file for testing."""
     audio_file = tmp_path / "test_audio.wav"
-    audio_file.touch()
+    audio_file.write_bytes(silent_wav_bytes)
     return audio_file
 
 
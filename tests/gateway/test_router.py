@@ -0,0 +1,157 @@
+"""Test smart router model selection."""
+
+import numpy as np
+
+from av_studio.config.settings import ModelProvider
+from av_studio.gateway import router as router_module
+from av_studio.gateway.router import ModelCapability, RouterConfig, SmartRouter, TaskType
+
+
+def test_route_prefers_best_local_model():
+    """Test that free local models win for tasks they support."""
+    router = SmartRouter()
+    decision = router.route(TaskType.CHAT, 1000)
+    assert decision.model_key == "ollama:qwen2.5-coder:7b"
+    assert decision.estimated_cost == 0.0
+    assert decision.model.is_local
+
+
+def test_route_filters_by_context_length():
+    """Test that models with too small a context window are skipped."""
+    router = SmartRouter()
+    decision = router.route(TaskType.CHAT, 150_000)
+    assert decision.model_key == "google:gemini-2.0-flash"
+    assert decision.estimated_cost > 0
+
+
+def test_route_falls_back_when_nothing_matches():
+    """Test the fallback model is used when no candidate survives filtering."""
+    router = SmartRouter()
+    decision = router.route(TaskType.VIDEO_ANALYSIS, 1000, require_local=True)
+    assert decision.model_key == RouterConfig().fallback_model
+    assert decision.reason == "No suitable model found, using fallback"
+
+
+def test_route_respects_max_cost():
+    """Test that an explicit zero budget only allows free models."""
+    router = SmartRouter()
+    decision = router.route(TaskType.IMAGE_ANALYSIS, 1000, max_cost=0.0)
+    assert decision.model_key == RouterConfig().fallback_model
+
+
+def test_record_latency_updates_estimate():
+    """Test that observed latency feeds back into routing."""
+    router = SmartRouter()
+    for _ in range(10):
+        router.record_latency("ollama:qwen2.5-coder:7b", 5000)
+
+    decision = router.route(TaskType.CHAT, 1000)
+    assert decision.model_key == "mlx:llama-3.2-8b"
+
+
+def test_route_batch_matches_route():
+    """Test that batch routing agrees with routing one request at a time."""
+    router = SmartRouter()
+    tasks = [TaskType.CHAT, TaskType.CHAT, TaskType.VIDEO_ANALYSIS, TaskType.SUMMARIZATION]
+    tokens = [1000, 150_000, 2000, 50_000]
+
+    decisions = router.route_batch(tasks, tokens)
+    assert decisions == [router.route(t, n) for t, n in zip(tasks, tokens, strict=True)]
+
+
+def test_route_matches_route_batch_at_context_limits():
+    """Test that bucketing never pushes a request past a model's exact limits."""
+    router = SmartRouter()
+    cases = [
+        (TaskType.CODE, 32_000, False),
+        (TaskType.CODE, 32_001, False),
+        (TaskType.CHAT, 128_000, True),
+        (TaskType.CHAT, 128_001, False),
+    ]
+    for task, tokens, require_local in cases:
+        decision = router.route(task, tokens, require_local=require_local)
+        batch = router.route_batch([task], [tokens], require_local=require_local)
+        assert [decision] == batch
+
+    assert router.route(TaskType.CODE, 32_000).model_key == "ollama:qwen2.5-coder:7b"
+    assert router.route(TaskType.CHAT, 128_000, require_local=True).model.is_local
+
+
+def test_route_checks_exact_cost_against_budget():
+    """Test that a request just over budget is rejected despite a cheaper bucket."""
+    router = SmartRouter()
+    gemini = router.get_model("google:gemini-2.0-flash")
+    budget = router._calculate_cost(gemini, 150_000, 500) - 1e-6
+
+    decision = router.route(TaskType.CHAT, 150_000, max_cost=budget)
+    assert decision.model_key == RouterConfig().fallback_model
+    assert [decision] == router.route_batch([TaskType.CHAT], [150_000], max_cost=budget)
+
+
+def test_route_caches_selection_per_token_bucket():
+    """Test that nearby token counts reuse the cached selection."""
+    router = SmartRouter()
+    first = router.route(TaskType.CHAT, 1000)
+    second = router.route(TaskType.CHAT, 1010)
+
+    assert second.model_key == first.model_key
+    assert router._select.cache_info().hits == 1
+
+
+def test_record_latency_invalidates_cached_selection():
+    """Test that only a significant latency shift starts a new routing epoch."""
+    router = SmartRouter()
+    router.record_latency("mlx:llama-3.2-8b", 31)
+    assert router._routing_epoch == 0
+
+    router.record_latency("mlx:llama-3.2-8b", 500)
+    assert router._routing_epoch == 1
+
+
+def test_frontier_prunes_dominated_models():
+    """Test that a model beaten on every axis is never scored."""
+    router = SmartRouter()
+    frontier = [router._model_keys[i] for i in router._frontier_by_task[TaskType.SUMMARIZATION]]
+
+    # Same price, quality and context as MLX Llama but slower
+    assert frontier == ["mlx:llama-3.2-8b"]
+
+
+def test_frontier_tracks_latency_within_an_epoch(monkeypatch):
+    """Test that a sub-threshold latency shift cannot prune the best-scoring model."""
+    models = tuple(
+        ModelCapability(
+            key=f"mlx:{name}",
+            provider=ModelProvider.MLX,
+            model_id=name,
+            supports=(TaskType.CHAT,),
+            max_context=8000,
+            cost_per_1k_input=0.0,
+            cost_per_1k_output=0.0,
+            avg_latency_ms=latency,
+            quality_score=0.9,
+            is_local=True,
+        )
+        for name, latency in (("fast", 100), ("steady", 105))
+    )
+    monkeypatch.setattr(router_module, "MODEL_REGISTRY", models)
+    monkeypatch.setattr(router_module, "MODEL_INDEX", {m.key: i for i, m in enumerate(models)})
+    router = SmartRouter()
+    assert router._model_keys[router._frontier_by_task[TaskType.CHAT][0]] == "mlx:fast"
+
+    router.record_latency("mlx:fast", 109)
+    assert router._routing_epoch == 0
+
+    unpruned = int(np.argmax(router._score(np.zeros(len(models)))))
+    assert router.route(TaskType.CHAT, 1000).model_key == router._model_keys[unpruned]
+    assert router.route(TaskType.CHAT, 1000).model_key == "mlx:steady"
+
+
+def test_latency_estimate_uses_last_ten_samples():
+    """Test the moving average once the ring buffer has wrapped."""
+    router = SmartRouter()
+    model = router.get_model("openai:gpt-4o")
+    for latency in range(1, 151):
+        router.record_latency("openai:gpt-4o", latency)
+
+    assert router._get_latency_estimate("openai:gpt-4o", model) == int(sum(range(141, 151)) / 10)
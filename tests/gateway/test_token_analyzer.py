@@ -0,0 +1,88 @@
+"""Test token analysis and cost calculation."""
+
+from av_studio.gateway import token_analyzer
+from av_studio.gateway.token_analyzer import (
+    CostCalculator,
+    TokenAnalyzer,
+    clear_tokenizer_cache,
+    get_tokenizer,
+)
+
+
+def test_pricing_prefers_most_specific_key():
+    """Test that longer pricing keys win over their prefixes."""
+    calculator = CostCalculator()
+    assert calculator._get_pricing("gpt-4o-mini") == CostCalculator.PRICING["gpt-4o-mini"]
+    assert calculator._get_pricing("GPT-4o") == CostCalculator.PRICING["gpt-4o"]
+
+
+def test_unknown_model_is_priced_as_free():
+    """Test the local-model fallback for unrecognized names."""
+    estimate = CostCalculator().estimate_cost("my-local-model", 1000, 1000)
+    assert estimate.total_cost == 0.0
+
+
+def test_summary_totals_outlive_history_window():
+    """Test that per-model totals cover requests dropped from the history."""
+    calculator = CostCalculator(history_size=2)
+    for _ in range(3):
+        calculator.record_cost(calculator.estimate_cost("gpt-4o", 1000, 0))
+
+    summary = calculator.get_summary()
+    assert len(calculator.spending_history) == 2
+    assert summary["request_count"] == 3
+    assert summary["by_model"]["gpt-4o"] == calculator.total_spent
+
+
+def test_messages_counted_per_message():
+    """Test OpenAI's per-message framing is added to message token counts."""
+    analyzer = TokenAnalyzer()
+    messages = [
+        {"role": "system", "content": "Be brief."},
+        {"role": "user", "content": "Hello", "name": "sam"},
+    ]
+    pieces = ["system", "Be brief.", "user", "Hello", "sam"]
+
+    count = analyzer.count_tokens(messages, "gpt-4o")
+    expected = sum(analyzer._count_tiktoken_batch(pieces, "gpt-4o")) + 3 + 2 * 3 + 1
+    assert count.input_tokens == expected
+
+
+def test_non_string_message_values_are_counted():
+    """Test that None, numbers and content-part lists do not break counting."""
+    analyzer = TokenAnalyzer()
+    parts = [{"type": "text", "text": "Hello"}]
+    messages = [
+        {"role": "assistant", "content": None},
+        {"role": "user", "content": parts, "name": 42},
+    ]
+    pieces = ["assistant", "user", str(parts), "42"]
+
+    count = analyzer.count_tokens(messages, "gpt-4o")
+    expected = sum(analyzer._count_tiktoken_batch(pieces, "gpt-4o")) + 3 + 2 * 3 + 1
+    assert count.input_tokens == expected
+
+
+def test_cached_input_tokens_are_discounted():
+    """Test that prompt-cache hits are billed at the cached rate."""
+    calculator = CostCalculator()
+    cached = calculator.cacheable_prompt_tokens(2100)
+    assert cached == 2048
+    assert calculator.cacheable_prompt_tokens(1000) == 0
+
+    full = calculator.estimate_cost("gpt-4o", 2100, 0)
+    discounted = calculator.estimate_cost("gpt-4o", 2100, 0, cached_input_tokens=cached)
+    assert discounted.input_cost == (2100 - cached / 2) / 1000 * 0.0025
+    assert discounted.total_cost < full.total_cost
+
+
+def test_clear_tokenizer_cache(monkeypatch):
+    """Test that clearing the cache makes the next lookup build a fresh encoding."""
+    monkeypatch.setattr(token_analyzer.tiktoken, "encoding_for_model", lambda model: object())
+    clear_tokenizer_cache()
+    first = get_tokenizer("gpt-4o")
+    assert get_tokenizer("gpt-4o") is first
+
+    clear_tokenizer_cache()
+    assert get_tokenizer("gpt-4o") is not first
+    clear_tokenizer_cache()
@@ -0,0 +1,110 @@
+"""Test MLX client behaviour that runs without MLX installed."""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from av_studio.llm import mlx_client
+from av_studio.llm.mlx_client import RECOMMENDED_MLX_MODELS, MLXClient, MLXConfig
+
+
+def test_full_precision_source_requires_quantized_build(tmp_path, monkeypatch):
+    """Test that fast-q3 is never loaded as its full-precision weights."""
+    monkeypatch.setattr(mlx_client, "QUANTIZED_MLX_DIR", tmp_path)
+    client = MLXClient(MLXConfig(speculative=False))
+
+    with pytest.raises(FileNotFoundError, match="quantize_model"):
+        client.load_model(RECOMMENDED_MLX_MODELS["fast-q3"])
+    assert client._model is None
+
+
+def test_quantized_build_is_preferred(tmp_path, monkeypatch):
+    """Test that an existing quantize_model() build replaces the source path."""
+    monkeypatch.setattr(mlx_client, "QUANTIZED_MLX_DIR", tmp_path)
+    client = MLXClient()
+    source = RECOMMENDED_MLX_MODELS["fast-q3"]
+    build = mlx_client.quantized_model_dir(source)
+    build.mkdir()
+
+    assert client._resolve_load_path(source) == str(build)
+    assert (
+        client._resolve_load_path(RECOMMENDED_MLX_MODELS["fast"]) == RECOMMENDED_MLX_MODELS["fast"]
+    )
+
+
+async def _collect(stream):
+    return [token async for token in stream]
+
+
+def test_worker_stream_yields_text(tmp_path):
+    """Test that tokens streamed through the worker socket arrive as str."""
+    socket_path = str(tmp_path / "mlx.sock")
+
+    async def reply(reader, writer):
+        await reader.readline()
+        for line in (b'{"token": "Hel"}\n', b'{"token": "lo"}\n', b'{"done": true}\n'):
+            writer.write(line)
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_unix_server(reply, path=socket_path)
+        async with server:
+            client = MLXClient(MLXConfig(worker_socket=socket_path))
+            return await _collect(client.stream_generate("hi"))
+
+    assert asyncio.run(run()) == ["Hel", "lo"]
+
+
+def test_in_process_stream_yields_text(monkeypatch):
+    """Test that in-process streaming yields text, not mlx_lm response objects."""
+    mlx_lm = pytest.importorskip("mlx_lm")
+    responses = [SimpleNamespace(text="Hel"), SimpleNamespace(text="lo")]
+    monkeypatch.setattr(mlx_lm, "stream_generate", lambda **kwargs: iter(responses))
+    client = MLXClient(MLXConfig(speculative=False))
+    monkeypatch.setattr(client, "load_model", lambda: None)
+    monkeypatch.setattr(client, "_sampling_kwargs", lambda temperature: {})
+
+    assert asyncio.run(_collect(client.stream_generate("hi"))) == ["Hel", "lo"]
+
+
+class _RecordingClient(MLXClient):
+    """Client whose decodes record their prompts instead of running a model."""
+
+    def __init__(self) -> None:
+        super().__init__(MLXConfig(speculative=False))
+        self.single: list[str] = []
+        self.batches: list[list[str]] = []
+
+    def generate(self, prompt, max_tokens=None, temperature=None, system_prompt=None):
+        self.single.append(prompt)
+        return prompt.upper()
+
+    def generate_batch(self, prompts, system_prompts, max_tokens=None):
+        self.batches.append(prompts)
+        return [prompt.upper() for prompt in prompts]
+
+
+def test_submit_runs_lone_prompt_through_generate():
+    """Test that a single queued prompt skips the batch decoder."""
+    client = _RecordingClient()
+
+    async def run():
+        return await asyncio.gather(client.submit("a", "sys"), client.submit("a", "sys"))
+
+    assert asyncio.run(run()) == ["A", "A"]
+    assert client.single == ["a"]
+    assert client.batches == []
+
+
+def test_submit_batches_concurrent_prompts():
+    """Test that prompts queued together share one batched decode."""
+    client = _RecordingClient()
+
+    async def run():
+        return await asyncio.gather(*(client.submit(p, "sys") for p in ("a", "b", "c")))
+
+    assert asyncio.run(run()) == ["A", "B", "C"]
+    assert client.batches == [["a", "b", "c"]]
+    assert client.single == []
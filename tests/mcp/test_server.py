@@ -0,0 +1,61 @@
+"""Test MCP server wiring."""
+
+import asyncio
+import json
+
+import pytest
+
+from av_studio.mcp import server
+
+
+def test_server_app_name():
+    """Test that the single server module is the one registered as av-studio."""
+    assert server.app.name == "av-studio"
+
+
+def test_every_tool_has_a_handler():
+    """Test that each advertised tool dispatches to a handler."""
+    tools = asyncio.run(server.list_tools())
+    assert {tool.name for tool in tools} == set(server._HANDLERS)
+
+
+def test_unknown_tool():
+    """Test that unknown tool names return an error message."""
+    result = asyncio.run(server.call_tool("missing", {}))
+    assert result[0].text == "Unknown tool: missing"
+
+
+def test_route_model_response_is_json():
+    """Test that the templated route_model response parses as JSON."""
+    result = asyncio.run(server.call_tool("route_model", {"task_type": "chat"}))
+    response = json.loads(result[0].text)
+    assert response["model"] == "ollama:qwen2.5-coder:7b"
+    assert response["estimated_cost"] == 0.0
+
+
+def test_route_model_uses_exact_input_length():
+    """Test that routing is not pushed past a context limit by rounding."""
+    arguments = {"task_type": "chat", "input_length": 70_000}
+    response = json.loads(asyncio.run(server.call_tool("route_model", arguments))[0].text)
+
+    decision = server._router().smart_router.route(server._router().TaskType.CHAT, 70_000)
+    assert response["model"] == decision.model_key
+    assert response["estimated_cost"] == decision.estimated_cost
+
+
+def test_analyze_cost_response_is_json():
+    """Test that the templated analyze_cost response parses as JSON."""
+    model = 'gemini-1.5-pro "preview"\\eu'
+    arguments = {"text": "x" * 4000, "model": model}
+    response = json.loads(asyncio.run(server.call_tool("analyze_cost", arguments))[0].text)
+
+    tokens, cost = response["tokens"], response["cost"]
+    assert tokens["input_tokens"] == 1000
+    assert tokens["total_tokens"] == tokens["input_tokens"] + tokens["estimated_output_tokens"]
+    assert tokens["cached_tokens"] == 0
+    assert cost["model"] == model
+    assert cost["currency"] == "USD"
+    assert cost["total_cost"] == pytest.approx(cost["input_cost"] + cost["output_cost"])
+    assert cost["effective_cost"] == cost["total_cost"]
+    assert cost["breakdown"]["input_tokens"] == 1000
+    assert cost["breakdown"]["input_rate"] == 0.00125
@@ -0,0 +1,45 @@
+"""Test BS.1770 integrated loudness against reference signals."""
+
+import math
+
+import pytest
+
+from av_studio.processing.audio.pipeline import integrated_loudness
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchaudio")
+
+SAMPLE_RATE = 48000
+
+
+def _sine(seconds: float, amplitude: float) -> "torch.Tensor":
+    """Mono 997 Hz sine, the BS.1770 calibration tone."""
+    t = torch.arange(int(seconds * SAMPLE_RATE), dtype=torch.float64) / SAMPLE_RATE
+    return (amplitude * torch.sin(2 * math.pi * 997 * t))[None]
+
+
+def test_full_scale_sine_reads_minus_3_lufs():
+    """Test the BS.1770 reference: a 0 dBFS 997 Hz tone in one channel is -3.01 LUFS."""
+    assert integrated_loudness(_sine(10, 1.0), SAMPLE_RATE) == pytest.approx(-3.01, abs=0.1)
+
+
+def test_level_change_shifts_loudness_in_db():
+    """Test that a -20 dB tone reads 20 LU lower."""
+    full_scale = integrated_loudness(_sine(10, 1.0), SAMPLE_RATE)
+    assert integrated_loudness(_sine(10, 0.1), SAMPLE_RATE) == pytest.approx(full_scale - 20)
+
+
+def test_absolute_gate_ignores_silence():
+    """Test that blocks below -70 LUFS do not pull the measurement down."""
+    silence = torch.zeros(1, 10 * SAMPLE_RATE, dtype=torch.float64)
+    waveform = torch.cat([_sine(10, 0.1), silence], -1)
+    tone = integrated_loudness(_sine(10, 0.1), SAMPLE_RATE)
+    # Ungated, the silent half would cost 3 LU; only the edge blocks remain
+    assert integrated_loudness(waveform, SAMPLE_RATE) == pytest.approx(tone, abs=0.1)
+
+
+def test_relative_gate_ignores_quiet_passages():
+    """Test that blocks more than 10 LU under the ungated level are dropped."""
+    waveform = torch.cat([_sine(10, 1.0), _sine(10, 10 ** (-27 / 20))], -1)
+    tone = integrated_loudness(_sine(10, 1.0), SAMPLE_RATE)
+    assert integrated_loudness(waveform, SAMPLE_RATE) == pytest.approx(tone, abs=0.1)
@@ -0,0 +1,29 @@
+"""Test whisper.cpp model name resolution."""
+
+import pytest
+
+from av_studio.processing.audio.pipeline import whispercpp_model_name
+
+
+@pytest.mark.parametrize(
+    ("model_size", "quantization", "expected"),
+    [
+        ("large-v3", "q5_0", "large-v3-q5_0"),
+        ("large-v3", "fp16", "large-v3"),
+        ("medium", "q8_0", "medium-q8_0"),
+        ("tiny", "q5_0", "tiny-q5_1"),
+    ],
+)
+def test_published_models(model_size, quantization, expected):
+    """Test that each size resolves to a ggml checkpoint that exists."""
+    assert whispercpp_model_name(model_size, quantization) == expected
+
+
+@pytest.mark.parametrize(
+    ("model_size", "quantization"),
+    [("large-v3", "q4_0"), ("tiny", "q4_0"), ("large-v3", "q8_0"), ("base", "q2_k")],
+)
+def test_unpublished_models_raise(model_size, quantization):
+    """Test that unpublished quants fail up front instead of at download."""
+    with pytest.raises(ValueError, match="No published whisper.cpp model"):
+        whispercpp_model_name(model_size, quantization)